@@ -0,0 +1,49 @@
+"""Модуль для одновременной работы нескольких аккаунтов в отдельных процессах"""
+import multiprocessing
+
+import nodriver as uc
+
+import main
+from db_manager import DEFAULT_ACCOUNT
+
+# Аккаунты и папки их профилей браузера.
+# Первый аккаунт сканирует списки раздач для всех остальных.
+ACCOUNT_PROFILES = {
+    DEFAULT_ACCOUNT: "browser_profile",
+    # "second": "browser_profile_second",
+}
+
+
+def run_account(account, profile_name, scan):
+    """Запуск основного скрипта для одного аккаунта в текущем процессе."""
+    uc.loop().run_until_complete(
+        main.main(account, profile_name, scan=scan, shared=True))
+
+
+def run_accounts(profiles=None):
+    """Запуск всех аккаунтов, каждого в своём процессе со своим браузером."""
+    profiles = ACCOUNT_PROFILES if profiles is None else profiles
+    processes = []
+
+    for index, (account, profile_name) in enumerate(profiles.items()):
+        process = multiprocessing.Process(
+            target=run_account,
+            args=(account, profile_name, index == 0),
+            name=f"account-{account}"
+        )
+        process.start()
+        processes.append(process)
+        print(f"Запущен аккаунт {account} (профиль {profile_name}, процесс {process.pid})")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    run_accounts()
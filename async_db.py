@@ -0,0 +1,216 @@
+"""Модуль для неблокирующей работы с базой данных раздач из цикла событий"""
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db_manager import (
+    DEFAULT_ACCOUNT, DEFAULT_PROFILE, LEASE_TTL, QUEUE_BATCH_SIZE, RaffleDatabase,
+    lease_owner)
+
+# Максимальное количество изменений, фиксируемых одной транзакцией
+MAX_GROUP_SIZE = 200
+
+
+def _resolve(future, result, error):
+    """Передаёт результат операции ожидающей корутине."""
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class AsyncRaffleDatabase:
+    """Асинхронная обёртка над RaffleDatabase.
+
+    Все изменения выполняются в отдельном потоке записи: накопившиеся
+    в очереди операции фиксируются одной транзакцией. Чтение идёт через
+    отдельное соединение в своём потоке, поэтому ни запись, ни чтение не
+    блокируют цикл событий браузера.
+    """
+
+    def __init__(self, db_file="raffles.db", profile=DEFAULT_PROFILE,
+                 account=DEFAULT_ACCOUNT, shared=False):
+        """Инициализация и запуск потока записи."""
+        self.db_file = db_file
+        self.profile = profile
+        self.account = account
+        self.shared = shared
+        # Соединения записи и чтения арендуют раздачи от имени одного владельца
+        self.owner = lease_owner()
+        self._writes = queue.Queue()
+        self._ready = threading.Event()
+        self._read_db = None
+        # Ошибка открытия базы потоком записи: с ней завершаются все изменения
+        self._open_error = None
+        self._reader = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="raffle-db-reader")
+        self._writer = threading.Thread(
+            target=self._writer_loop, name="raffle-db-writer", daemon=True)
+        self._writer.start()
+
+    def _open(self):
+        """Открытие соединения с настройками обёртки."""
+        return RaffleDatabase(
+            self.db_file, self.profile, self.account, self.shared, self.owner)
+
+    def _writer_loop(self):
+        """Цикл потока записи с групповой фиксацией изменений."""
+        try:
+            db = self._open()
+        except Exception as e:
+            self._open_error = e
+            self._ready.set()
+            self._fail_writes(e)
+            return
+        self._ready.set()
+        running = True
+
+        while running:
+            operations = [self._writes.get()]
+            while len(operations) < MAX_GROUP_SIZE:
+                try:
+                    operations.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in operations:
+                running = False
+                operations = [operation for operation in operations if operation]
+
+            results = []
+            try:
+                with db.batch():
+                    for method, args, kwargs, future, loop in operations:
+                        try:
+                            results.append(
+                                (getattr(db, method)(*args, **kwargs), None))
+                        except Exception as e:
+                            results.append((None, e))
+            except Exception as e:
+                results = [(None, e)] * len(operations)
+
+            for (result, error), (_, _, _, future, loop) in zip(results, operations):
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+
+        db.close()
+
+    def _fail_writes(self, error):
+        """Завершение ошибкой всех изменений, ожидающих в очереди, до закрытия."""
+        while True:
+            operation = self._writes.get()
+            if operation is None:
+                return
+            _, _, _, future, loop = operation
+            loop.call_soon_threadsafe(_resolve, future, None, error)
+
+    def _read_in_thread(self, method, args, kwargs):
+        """Выполнение чтения через соединение потока чтения."""
+        if self._read_db is None:
+            # Схему создаёт и обновляет поток записи
+            self._ready.wait()
+            if self._open_error is not None:
+                raise self._open_error
+            self._read_db = self._open()
+        return getattr(self._read_db, method)(*args, **kwargs)
+
+    async def _write(self, method, *args, **kwargs):
+        if self._open_error is not None:
+            raise self._open_error
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._writes.put((method, args, kwargs, future, loop))
+        return await future
+
+    async def _read(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._reader, self._read_in_thread, method, args, kwargs)
+
+    async def add_raffles(self, raffles):
+        """Пакетное добавление раздач. Возвращает кортеж (новых, уже существующих)."""
+        return await self._write('add_raffles', list(raffles))
+
+    async def delete_raffle(self, url):
+        """Удаление раздачи."""
+        return await self._write('delete_raffle', url)
+
+    async def tombstone_raffle(self, url, reason, ttl):
+        """Исключение раздачи из очереди на ttl секунд."""
+        return await self._write('tombstone_raffle', url, reason, ttl)
+
+    async def mark_as_processed(self, url, error=None):
+        """Отметка раздачи как обработанной."""
+        return await self._write('mark_as_processed', url, error)
+
+    async def record_failure(self, url, error, base_delay, max_delay):
+        """Запись неудачной попытки. Возвращает общее количество попыток."""
+        return await self._write(
+            'record_failure', url, error, base_delay, max_delay)
+
+    async def get_unprocessed_raffles(self, limit=None):
+        """Получение необработанных раздач."""
+        return await self._read('get_unprocessed_raffles', limit)
+
+    async def iter_unprocessed_raffles(self, batch_size=QUEUE_BATCH_SIZE, lease=LEASE_TTL):
+        """Асинхронный обход очереди необработанных раздач порциями по batch_size.
+
+        Каждая порция захватывается в аренду, поэтому другие процессы,
+        работающие с той же базой, эти раздачи не получат.
+        """
+        after = None
+        while True:
+            batch = await self._write('claim_raffles', after, batch_size, lease)
+            for raffle in batch:
+                yield raffle
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1]['queue_key'], batch[-1]['id'])
+
+    async def renew_leases(self, lease=LEASE_TTL):
+        """Продление аренды всех раздач этого процесса."""
+        return await self._write('renew_leases', lease)
+
+    async def release_raffle(self, url):
+        """Освобождение аренды раздачи."""
+        return await self._write('release_raffle', url)
+
+    async def release_leases(self, owner=None):
+        """Освобождение аренды всех раздач этого процесса или владельца owner."""
+        return await self._write('release_leases', owner)
+
+    async def set_run_state(self, **values):
+        """Сохранение значений состояния цикла работы."""
+        return await self._write('set_run_state', **values)
+
+    async def adopt_run_state(self):
+        """Состояние завершившегося прошлого запуска и количество освобождённых раздач."""
+        return await self._write('adopt_run_state')
+
+    async def get_known_urls(self, urls):
+        """Получение множества уже известных ссылок."""
+        return await self._read('get_known_urls', list(urls))
+
+    async def get_run_state(self):
+        """Сохранённое состояние цикла работы."""
+        return await self._read('get_run_state')
+
+    async def get_next_attempt_at(self):
+        """Ближайшее время повторной попытки."""
+        return await self._read('get_next_attempt_at')
+
+    async def get_stats(self):
+        """Получение статистики по раздачам."""
+        return await self._read('get_stats')
+
+    async def close(self):
+        """Завершение записи оставшихся изменений и закрытие соединений."""
+        self._writes.put(None)
+        await asyncio.to_thread(self._writer.join)
+
+        loop = asyncio.get_running_loop()
+        if self._read_db is not None:
+            await loop.run_in_executor(self._reader, self._read_db.close)
+        self._reader.shutdown(wait=True)
@@ -1,14 +1,147 @@
 """Модуль для управления базой данных раздач и хранения связанной информации"""
+import json
 import sqlite3
 import os
+import socket
 import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+import psutil
+
+# Столбцы, появившиеся после первой версии схемы.
+# В существующих базах недостающие столбцы добавляются при запуске.
+RAFFLE_COLUMNS = {
+    'attempts': 'INTEGER DEFAULT 0',
+    'last_error': 'TEXT',
+    'next_attempt_at': 'REAL DEFAULT 0',
+    'ends_at': 'REAL',
+    'entries': 'INTEGER',
+    'max_entries': 'INTEGER',
+    'title': 'TEXT',
+    'items': 'INTEGER',
+    'scanned_at': 'REAL',
+}
+
+# Профили производительности: настройки SQLite, применяемые при подключении.
+# В режиме WAL чтение из интерфейса и запись из основного скрипта не блокируют друг друга.
+PERFORMANCE_PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 64 * 1024 * 1024,
+        # Отрицательное значение - размер кэша в КБ
+        'cache_size': -16000,
+    },
+    # Для базы в общей сетевой папке, с которой работают несколько компьютеров.
+    # WAL работает только в пределах одного компьютера: на сетевых файловых
+    # системах он не поддерживается, и захват раздач в аренду перестаёт быть
+    # исключительным. Режим журнала сохраняется в файле базы, поэтому он
+    # переключается явно, а не просто не задаётся
+    'network': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 30000,
+    },
+}
+# Профиль по умолчанию рассчитан на процессы одного компьютера.
+# Если файл базы общий для нескольких компьютеров, нужен профиль 'network'
+DEFAULT_PROFILE = 'wal'
+
+# Общая часть ссылок на раздачи: в базе хранится только код раздачи после неё
+RAFFLE_URL_PREFIX = 'https://scrap.tf/raffles/'
+# Столбец с полной ссылкой для выборок из таблиц с кодами раздач
+URL_COLUMN = f"'{RAFFLE_URL_PREFIX}' || code AS url"
+
+# Столбцы, по которым объединяются записи одной раздачи при переходе на коды:
+# остаётся наибольшее значение среди объединяемых записей
+MERGED_COLUMNS = {
+    'raffles': ('processed', 'attempts'),
+    'tombstones': ('expires_at',),
+}
+
+# Порядок очереди необработанных раздач: сначала те, что скоро закончатся,
+# раздачи с неизвестным временем окончания - в конце
+QUEUE_ORDER = 'COALESCE(ends_at, 1e18)'
+# Сколько раздач очереди читается из базы за один запрос
+QUEUE_BATCH_SIZE = 20
+
+# Аккаунт, состояние участия которого хранится в самой таблице раздач.
+# Для остальных аккаунтов оно хранится в таблице raffle_entries
+DEFAULT_ACCOUNT = 'default'
+# Причины исключения, которые касаются только аккаунта, а не самой раздачи
+ACCOUNT_REASONS = {'requirements_not_met', 'max_attempts'}
+# Причины пропуска, которые для остальных аккаунтов тоже касаются только их:
+# раздача могла уже не подойти одному аккаунту, пока до неё дошла его очередь
+SKIP_REASONS = {'expired', 'full'}
+# Раздачи без времени окончания попадают в очередь остальных аккаунтов,
+# только если сканирование видело их в списке за это время (в секундах)
+LIVE_RAFFLE_WINDOW = 24 * 3600
+# Условие на идущую раздачу для очереди и статистики остальных аккаунтов
+LIVE_RAFFLE_FILTER = '(ends_at IS NOT NULL OR scanned_at > :recent)'
+
+# На сколько секунд раздача закрепляется за процессом, который её взял.
+# Если процесс не продлил аренду, раздачу может забрать другой
+LEASE_TTL = 5 * 60
+
+# Запросы для полного пересчёта счётчиков статистики
+COUNTER_QUERIES = {
+    'total': 'SELECT COUNT(*) FROM raffles',
+    'unprocessed': 'SELECT COUNT(*) FROM raffles WHERE processed = 0',
+    'processed': 'SELECT COUNT(*) FROM raffles WHERE processed = 1',
+}
+# Накопительные счётчики событий: по содержимому таблиц не пересчитываются
+EVENT_COUNTERS = ('expired',)
+
+
+def raffle_code(url):
+    """Код раздачи из ссылки в любом виде: полной, относительной или самого кода."""
+    url = url.strip().split('#')[0].split('?')[0].rstrip('/')
+    return url.rsplit('/', 1)[-1]
+
+
+def normalize_raffle_url(url):
+    """Приведение ссылки на раздачу к единому виду."""
+    return RAFFLE_URL_PREFIX + raffle_code(url)
+
+
+def lease_owner():
+    """Уникальное имя владельца аренды раздач: компьютер, процесс и случайная часть."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def owner_alive(owner, last_seen, now=None):
+    """Может ли владелец аренды ещё работать.
+
+    Владелец точно завершился, если он не продлевал аренду дольше LEASE_TTL
+    или работал на этом же компьютере и его процесса больше нет.
+    """
+    now = time.time() if now is None else now
+    if last_seen is None or now - last_seen > LEASE_TTL:
+        return False
+
+    host, _, rest = owner.partition(':')
+    pid = rest.partition(':')[0]
+    if host == socket.gethostname() and pid.isdigit():
+        return psutil.pid_exists(int(pid))
+    return True
 
 
 class RaffleDatabase:
     """Класс для управления базой данных раздач."""
 
-    def __init__(self, db_file="raffles.db"):
-        """Инициализация базы данных."""
+    def __init__(self, db_file="raffles.db", profile=DEFAULT_PROFILE,
+                 account=DEFAULT_ACCOUNT, shared=False, owner=None):
+        """Инициализация базы данных.
+
+        account - аккаунт, для которого ведётся состояние участия.
+        shared - база используется несколькими аккаунтами: причины из
+        ACCOUNT_REASONS не исключают раздачу для остальных аккаунтов.
+        owner - имя владельца аренды раздач; по умолчанию уникально для процесса.
+        """
 
         if getattr(sys, 'frozen', False):
             application_path = os.path.dirname(sys.executable)
@@ -16,7 +149,12 @@ class RaffleDatabase:
             application_path = os.path.dirname(os.path.abspath(__file__))
 
         self.db_file = os.path.join(application_path, db_file)
+        self.profile = profile
+        self.account = account
+        self.shared = shared
+        self.owner = owner or lease_owner()
         self.conn = None
+        self._batch_depth = 0
         self.create_tables()
 
     def create_tables(self):
@@ -27,23 +165,287 @@ class RaffleDatabase:
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS raffles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            url TEXT UNIQUE NOT NULL,
+            code TEXT UNIQUE NOT NULL,
             processed INTEGER DEFAULT 0
         )
         ''')
 
+        self._add_missing_columns(cursor, 'raffles', RAFFLE_COLUMNS)
+
+        # Раздачи, которые не нужно добавлять повторно до истечения срока
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tombstones (
+            code TEXT PRIMARY KEY,
+            reason TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''')
+
+        migrated = self._migrate_urls_to_codes(cursor)
+
+        # Частичный индекс только по необработанным раздачам в порядке очереди
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_raffles_queue ON raffles({QUEUE_ORDER}, id) '
+            'WHERE processed = 0')
+
+        # Состояние участия остальных аккаунтов
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS raffle_entries (
+            account TEXT NOT NULL,
+            raffle_id INTEGER NOT NULL,
+            processed INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at REAL DEFAULT 0,
+            PRIMARY KEY (account, raffle_id)
+        )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_raffle_entries_raffle ON raffle_entries(raffle_id)')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS raffles_entries_delete AFTER DELETE ON raffles
+        BEGIN
+            DELETE FROM raffle_entries WHERE raffle_id = OLD.id;
+        END
+        ''')
+
+        # Раздачи, которые сейчас обрабатывают процессы, работающие с этой базой
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS raffle_leases (
+            account TEXT NOT NULL,
+            raffle_id INTEGER NOT NULL,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (account, raffle_id)
+        )
+        ''')
         cursor.execute(
-            'CREATE INDEX IF NOT EXISTS idx_raffles_url ON raffles(url)')
+            'CREATE INDEX IF NOT EXISTS idx_raffle_leases_owner ON raffle_leases(owner)')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS raffles_leases_delete AFTER DELETE ON raffles
+        BEGIN
+            DELETE FROM raffle_leases WHERE raffle_id = OLD.id;
+        END
+        ''')
 
+        # Состояние цикла работы для продолжения после перезапуска.
+        # Хранится отдельно для каждого процесса, чтобы одновременно
+        # работающие процессы не перезаписывали состояние друг друга
+        cursor.execute("PRAGMA table_info(run_state)")
+        state_columns = {column[1] for column in cursor.fetchall()}
+        if state_columns and 'owner' not in state_columns:
+            # Состояние в старом формате было общим для аккаунта: оно не переносится
+            cursor.execute('DROP TABLE run_state')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_state (
+            owner TEXT NOT NULL,
+            account TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (owner, key)
+        )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_run_state_account ON run_state(account)')
+
+        if self.account != DEFAULT_ACCOUNT:
+            # Очередь аккаунта проходит по всем раздачам, а не только по необработанным
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS idx_raffles_order ON raffles({QUEUE_ORDER}, id)')
+
+        # Счётчики для статистики, обновляемые триггерами в тех же транзакциях
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS raffle_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS raffles_counters_insert AFTER INSERT ON raffles
+        BEGIN
+            UPDATE raffle_counters SET value = value + 1 WHERE name = 'total';
+            UPDATE raffle_counters SET value = value + (NEW.processed = 0) WHERE name = 'unprocessed';
+            UPDATE raffle_counters SET value = value + (NEW.processed = 1) WHERE name = 'processed';
+        END
+        ''')
+
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS raffles_counters_delete AFTER DELETE ON raffles
+        BEGIN
+            UPDATE raffle_counters SET value = value - 1 WHERE name = 'total';
+            UPDATE raffle_counters SET value = value - (OLD.processed = 0) WHERE name = 'unprocessed';
+            UPDATE raffle_counters SET value = value - (OLD.processed = 1) WHERE name = 'processed';
+        END
+        ''')
+
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS raffles_counters_update AFTER UPDATE OF processed ON raffles
+        BEGIN
+            UPDATE raffle_counters
+            SET value = value - (OLD.processed = 0) + (NEW.processed = 0)
+            WHERE name = 'unprocessed';
+            UPDATE raffle_counters
+            SET value = value - (OLD.processed = 1) + (NEW.processed = 1)
+            WHERE name = 'processed';
+        END
+        ''')
+
+        conn.commit()
+
+        # Первое заполнение счётчиков для существующей базы
+        cursor.executemany(
+            'INSERT OR IGNORE INTO raffle_counters (name, value) VALUES (?, 0)',
+            [(name,) for name in EVENT_COUNTERS]
+        )
         conn.commit()
+        placeholders = ', '.join('?' * len(COUNTER_QUERIES))
+        cursor.execute(
+            f'SELECT COUNT(*) FROM raffle_counters WHERE name IN ({placeholders})',
+            tuple(COUNTER_QUERIES)
+        )
+        if cursor.fetchone()[0] != len(COUNTER_QUERIES):
+            self.rebuild_counters()
+
+        if migrated:
+            # Освобождение места, занятого полными ссылками
+            conn.execute('VACUUM')
+
+    def _migrate_urls_to_codes(self, cursor):
+        """Переход старых баз с полных ссылок на коды раздач.
+
+        Весь переход выполняется одной транзакцией: если процесс прервётся
+        посередине, база останется в старом виде и переход повторится.
+        Базы, где переход когда-то прервался после переименования столбца,
+        узнаются по полным ссылкам в столбце code и доводятся до конца.
+        Возвращает True, если база была изменена.
+        """
+        migrated = False
+        self.conn.create_function('raffle_code', 1, raffle_code, deterministic=True)
+
+        with self.batch():
+            for table in ('raffles', 'tombstones'):
+                cursor.execute(f'PRAGMA table_info({table})')
+                if 'url' in {row[1] for row in cursor.fetchall()}:
+                    cursor.execute(f'ALTER TABLE {table} RENAME COLUMN url TO code')
+                else:
+                    cursor.execute(f"SELECT 1 FROM {table} WHERE code LIKE '%/%' LIMIT 1")
+                    if cursor.fetchone() is None:
+                        continue
+
+                # Ссылки, которые отличались только видом, сводятся к одной записи.
+                # Перед этим каждая из них получает самое продвинутое состояние группы,
+                # чтобы уцелевшая запись не потеряла, например, отметку об участии
+                merge = MERGED_COLUMNS[table]
+                cursor.execute('DROP TABLE IF EXISTS temp.merged_codes')
+                cursor.execute(
+                    f'''CREATE TEMP TABLE merged_codes AS
+                    SELECT raffle_code(code) AS code,
+                        {', '.join(f'MAX({column}) AS {column}' for column in merge)}
+                    FROM {table} GROUP BY raffle_code(code) HAVING COUNT(*) > 1'''
+                )
+                cursor.execute('CREATE UNIQUE INDEX temp.idx_merged_codes ON merged_codes(code)')
+                cursor.execute(
+                    f'''UPDATE {table} SET
+                        {', '.join(
+                            f'{column} = (SELECT {column} FROM merged_codes '
+                            f'WHERE merged_codes.code = raffle_code({table}.code))'
+                            for column in merge)}
+                    WHERE raffle_code(code) IN (SELECT code FROM merged_codes)'''
+                )
+                cursor.execute('DROP TABLE temp.merged_codes')
+
+                cursor.execute(f'UPDATE OR IGNORE {table} SET code = raffle_code(code)')
+                cursor.execute(f"DELETE FROM {table} WHERE code LIKE '%/%'")
+                migrated = True
+
+            # Уникальный ключ уже проиндексирован, отдельный индекс только занимал место
+            cursor.execute('DROP INDEX IF EXISTS idx_raffles_url')
+        return migrated
+
+    @staticmethod
+    def _add_missing_columns(cursor, table, columns):
+        """Добавляет в таблицу отсутствующие столбцы."""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(
+                    f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
 
     def connect(self):
         """Подключение к базе данных."""
         if self.conn is None:
             self.conn = sqlite3.connect(self.db_file)
             self.conn.row_factory = sqlite3.Row
+            self._apply_profile()
         return self.conn
 
+    def _apply_profile(self):
+        """Применение настроек профиля производительности к соединению."""
+        for pragma, value in PERFORMANCE_PROFILES[self.profile].items():
+            self.conn.execute(f'PRAGMA {pragma} = {value}')
+
+    def get_settings(self):
+        """Получение действующих настроек SQLite для соединения."""
+        conn = self.connect()
+        settings = {'profile': self.profile}
+
+        for pragma in PERFORMANCE_PROFILES['wal']:
+            settings[pragma] = conn.execute(f'PRAGMA {pragma}').fetchone()[0]
+        return settings
+
+    @contextmanager
+    def batch(self):
+        """Объединение изменений нескольких вызовов в одну транзакцию."""
+        conn = self.connect()
+        if not self._batch_depth and not conn.in_transaction:
+            # Блокировка записи берётся сразу, чтобы чтение и запись внутри
+            # пакета не пересекались с изменениями других процессов
+            conn.execute('BEGIN IMMEDIATE')
+        self._batch_depth += 1
+
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                conn.rollback()
+            raise
+
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            conn.commit()
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция для изменений одного метода.
+
+        Внутри batch() изменения фиксируются вместе со всем пакетом,
+        а при ошибке отменяются только изменения этого метода.
+        """
+        conn = self.connect()
+        if not self._batch_depth:
+            with conn:
+                yield conn
+            return
+
+        conn.execute('SAVEPOINT raffle_change')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK TO raffle_change')
+            conn.execute('RELEASE raffle_change')
+            raise
+        conn.execute('RELEASE raffle_change')
+
+    def _commit(self):
+        """Фиксация изменений, если не идёт пакетная запись."""
+        if not self._batch_depth:
+            self.conn.commit()
+
     def close(self):
         """Закрытие соединения с базой данных."""
         if self.conn:
@@ -57,10 +459,10 @@ class RaffleDatabase:
 
         try:
             cursor.execute(
-                'INSERT INTO raffles (url, processed) VALUES (?, 0)',
-                (url,)
+                'INSERT INTO raffles (code, processed) VALUES (?, 0)',
+                (raffle_code(url),)
             )
-            conn.commit()
+            self._commit()
             rows_affected = cursor.rowcount
             return rows_affected > 0
         except sqlite3.IntegrityError as e:
@@ -73,75 +475,582 @@ class RaffleDatabase:
             print(f"Ошибка в данных при добавлении раздачи: {e}")
             return False
 
+    def add_raffles(self, raffles):
+        """Пакетное добавление раздач одной транзакцией.
+
+        Принимает ссылки или словари с ключом url и необязательными
+        ends_at, entries, max_entries, title, items, entered. Для уже
+        известных раздач эти данные обновляются, а раздачи с entered
+        отмечаются как обработанные для аккаунта базы.
+
+        Возвращает кортеж (новых, уже существующих). Раздачи из списка
+        исключённых не добавляются и считаются существующими.
+        """
+        records = {}
+        for raffle in raffles:
+            if isinstance(raffle, str):
+                raffle = {'url': raffle}
+            records.setdefault(raffle_code(raffle['url']), raffle)
+
+        if not records:
+            return 0, 0
+
+        conn = self.connect()
+        now = time.time()
+        rows = [
+            {
+                'code': code,
+                'ends_at': record.get('ends_at'),
+                'entries': record.get('entries'),
+                'max_entries': record.get('max_entries'),
+                'title': record.get('title'),
+                'items': record.get('items'),
+                'entered': int(bool(record.get('entered'))),
+                'default_entered': int(
+                    bool(record.get('entered')) and self.account == DEFAULT_ACCOUNT),
+                'account': self.account,
+                'scanned_at': now,
+            }
+            for code, record in records.items()
+        ]
+
+        try:
+            with self._transaction():
+                # Просроченные записи больше не блокируют добавление
+                conn.execute(
+                    'DELETE FROM tombstones WHERE expires_at <= ?', (now,))
+                # Раздачи, в которых мы уже участвуем, сразу считаются обработанными.
+                # rowcount не учитывает изменения счётчиков, сделанные триггерами
+                cursor = conn.executemany(
+                    '''INSERT OR IGNORE INTO raffles (code, processed)
+                    SELECT :code, :default_entered WHERE NOT EXISTS (
+                        SELECT 1 FROM tombstones WHERE code = :code
+                    )''',
+                    rows
+                )
+                new_raffles = cursor.rowcount
+                conn.executemany(
+                    '''UPDATE raffles SET
+                        processed = MAX(processed, :default_entered),
+                        ends_at = COALESCE(:ends_at, ends_at),
+                        entries = COALESCE(:entries, entries),
+                        max_entries = COALESCE(:max_entries, max_entries),
+                        title = COALESCE(:title, title),
+                        items = COALESCE(:items, items),
+                        scanned_at = :scanned_at
+                    WHERE code = :code''',
+                    rows
+                )
+                if self.account != DEFAULT_ACCOUNT:
+                    conn.executemany(
+                        '''INSERT INTO raffle_entries (account, raffle_id, processed)
+                        SELECT :account, id, 1 FROM raffles
+                        WHERE code = :code AND :entered
+                        ON CONFLICT (account, raffle_id) DO UPDATE SET processed = 1''',
+                        rows
+                    )
+            return new_raffles, len(records) - new_raffles
+        except sqlite3.Error as e:
+            print(f"Ошибка SQLite при пакетном добавлении раздач: {e}")
+            return 0, 0
+
     def delete_raffle(self, url):
         """Удаляет раздачу из базы данных."""
         conn = self.connect()
         cursor = conn.cursor()
 
         try:
-            cursor.execute('DELETE FROM raffles WHERE url = ?', (url,))
-            conn.commit()
+            cursor.execute('DELETE FROM raffles WHERE code = ?', (raffle_code(url),))
+            self._commit()
             return cursor.rowcount > 0
         except sqlite3.Error as e:
             print(f"Ошибка при удалении раздачи из базы данных: {e}")
             return False
 
+    def tombstone_raffle(self, url, reason, ttl):
+        """Удаляет раздачу и запрещает её повторное добавление на ttl секунд.
+
+        Если базой пользуются несколько аккаунтов, а причина касается только
+        аккаунта (ACCOUNT_REASONS, а для неосновных аккаунтов и SKIP_REASONS),
+        раздача лишь отмечается обработанной для него.
+        """
+        if ((self.shared and reason in ACCOUNT_REASONS)
+                or (self.account != DEFAULT_ACCOUNT and reason in SKIP_REASONS)):
+            return self.mark_as_processed(url, reason)
+
+        conn = self.connect()
+        code = raffle_code(url)
+
+        try:
+            with self._transaction():
+                conn.execute('DELETE FROM raffles WHERE code = ?', (code,))
+                conn.execute(
+                    'INSERT OR REPLACE INTO tombstones (code, reason, expires_at) VALUES (?, ?, ?)',
+                    (code, reason, time.time() + ttl)
+                )
+                self._count_event(conn, reason)
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при добавлении раздачи в список исключённых: {e}")
+            return False
+
+    def is_tombstoned(self, url):
+        """Проверка, исключена ли раздача из повторного добавления."""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            'SELECT 1 FROM tombstones WHERE code = ? AND expires_at > ?',
+            (raffle_code(url), time.time())
+        )
+        return cursor.fetchone() is not None
+
+    def get_known_urls(self, urls):
+        """Получение множества ссылок, которые уже есть в базе или исключены."""
+        codes = {raffle_code(url): url for url in urls}
+        if not codes:
+            return set()
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        placeholders = ', '.join('?' * len(codes))
+
+        cursor.execute(
+            f'''SELECT code FROM raffles WHERE code IN ({placeholders})
+            UNION
+            SELECT code FROM tombstones
+            WHERE code IN ({placeholders}) AND expires_at > ?''',
+            (*codes, *codes, time.time())
+        )
+        return {codes[row[0]] for row in cursor.fetchall()}
+
     def is_raffle_exists(self, url):
         """Проверка, существует ли раздача в базе данных."""
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('SELECT 1 FROM raffles WHERE url = ?', (url,))
+        cursor.execute('SELECT 1 FROM raffles WHERE code = ?', (raffle_code(url),))
         return cursor.fetchone() is not None
 
-    def mark_as_processed(self, url):
-        """Отметить раздачу как обработанную."""
+    def mark_as_processed(self, url, error=None):
+        """Отметить раздачу как обработанную для аккаунта базы."""
         conn = self.connect()
         cursor = conn.cursor()
 
         try:
-            cursor.execute(
-                'UPDATE raffles SET processed = 1 WHERE url = ?',
-                (url,)
-            )
-            conn.commit()
+            if self.account == DEFAULT_ACCOUNT:
+                cursor.execute(
+                    'UPDATE raffles SET processed = 1, last_error = COALESCE(?, last_error) WHERE code = ?',
+                    (error, raffle_code(url))
+                )
+            else:
+                cursor.execute(
+                    '''INSERT INTO raffle_entries (account, raffle_id, processed, last_error)
+                    SELECT ?, id, 1, ? FROM raffles WHERE code = ?
+                    ON CONFLICT (account, raffle_id) DO UPDATE SET
+                        processed = 1,
+                        last_error = COALESCE(excluded.last_error, last_error)''',
+                    (self.account, error, raffle_code(url))
+                )
+            self._commit()
             return cursor.rowcount > 0
         except sqlite3.Error as e:
             print(f"Ошибка при обновлении статуса раздачи: {e}")
             return False
 
+    def record_failure(self, url, error, base_delay, max_delay):
+        """Записывает неудачную попытку и откладывает следующую.
+
+        Задержка удваивается с каждой попыткой, но не превышает max_delay.
+        Возвращает общее количество попыток.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        code = raffle_code(url)
+
+        try:
+            if self.account == DEFAULT_ACCOUNT:
+                cursor.execute(
+                    '''UPDATE raffles SET
+                        attempts = attempts + 1,
+                        last_error = ?,
+                        next_attempt_at = ? + MIN(?, ? * (1 << attempts))
+                    WHERE code = ?''',
+                    (error, time.time(), max_delay, base_delay, code)
+                )
+                cursor.execute(
+                    'SELECT attempts FROM raffles WHERE code = ?', (code,))
+            else:
+                cursor.execute(
+                    '''INSERT INTO raffle_entries (account, raffle_id, attempts, last_error, next_attempt_at)
+                    SELECT ?, id, 1, ?, ? + ? FROM raffles WHERE code = ?
+                    ON CONFLICT (account, raffle_id) DO UPDATE SET
+                        attempts = attempts + 1,
+                        last_error = excluded.last_error,
+                        next_attempt_at = ? + MIN(?, ? * (1 << attempts))''',
+                    (self.account, error, time.time(), base_delay, code,
+                     time.time(), max_delay, base_delay)
+                )
+                cursor.execute(
+                    '''SELECT attempts FROM raffle_entries
+                    WHERE account = ? AND raffle_id = (SELECT id FROM raffles WHERE code = ?)''',
+                    (self.account, code))
+            row = cursor.fetchone()
+            self._commit()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            print(f"Ошибка при записи неудачной попытки: {e}")
+            return 0
+
     def get_unprocessed_raffles(self, limit=None):
-        """Получение необработанных раздач."""
+        """Получение необработанных раздач, для которых наступило время попытки."""
         conn = self.connect()
         cursor = conn.cursor()
+        now = time.time()
 
         if limit is not None:
             cursor.execute(
-                'SELECT * FROM raffles WHERE processed = 0 LIMIT ?',
-                (limit,)
+                f'SELECT *, {URL_COLUMN} FROM raffles WHERE processed = 0 AND next_attempt_at <= ? LIMIT ?',
+                (now, limit)
             )
         else:
-            cursor.execute('SELECT * FROM raffles WHERE processed = 0')
+            cursor.execute(
+                f'SELECT *, {URL_COLUMN} FROM raffles WHERE processed = 0 AND next_attempt_at <= ?',
+                (now,)
+            )
 
         return cursor.fetchall()
 
+    def get_unprocessed_batch(self, after=None, limit=QUEUE_BATCH_SIZE):
+        """Следующая порция очереди необработанных раздач.
+
+        after - ключ последней полученной раздачи (queue_key, id) или None
+        для начала очереди. Каждая раздача содержит свой ключ в поле queue_key.
+        Раздачи, арендованные другими процессами, пропускаются.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        key, raffle_id = after if after is not None else (float('-inf'), 0)
+        params = {
+            'account': self.account,
+            'owner': self.owner,
+            'now': time.time(),
+            'key': key,
+            'id': raffle_id,
+            'limit': limit,
+        }
+        not_leased = '''NOT EXISTS (
+            SELECT 1 FROM raffle_leases
+            WHERE raffle_leases.account = :account AND raffle_leases.raffle_id = raffles.id
+                AND raffle_leases.owner != :owner AND raffle_leases.expires_at > :now
+        )'''
+
+        # Отдельное условие на ключ позволяет SQLite начать порцию с поиска по индексу
+        if self.account == DEFAULT_ACCOUNT:
+            cursor.execute(
+                f'''SELECT *, {URL_COLUMN}, {QUEUE_ORDER} AS queue_key FROM raffles
+                WHERE processed = 0 AND next_attempt_at <= :now
+                    AND {QUEUE_ORDER} >= :key AND ({QUEUE_ORDER}, id) > (:key, :id)
+                    AND {not_leased}
+                ORDER BY {QUEUE_ORDER}, id
+                LIMIT :limit''',
+                params
+            )
+        else:
+            # Очередь остальных аккаунтов - только идущие раздачи, а не вся история:
+            # закончившиеся пропускаются поиском по индексу с текущего времени
+            params['recent'] = params['now'] - LIVE_RAFFLE_WINDOW
+            cursor.execute(
+                f'''SELECT raffles.*, {URL_COLUMN}, {QUEUE_ORDER} AS queue_key FROM raffles
+                LEFT JOIN raffle_entries
+                    ON raffle_entries.account = :account AND raffle_entries.raffle_id = raffles.id
+                WHERE COALESCE(raffle_entries.processed, 0) = 0
+                    AND COALESCE(raffle_entries.next_attempt_at, 0) <= :now
+                    AND {LIVE_RAFFLE_FILTER}
+                    AND {QUEUE_ORDER} >= MAX(:key, :now) AND ({QUEUE_ORDER}, id) > (:key, :id)
+                    AND {not_leased}
+                ORDER BY {QUEUE_ORDER}, id
+                LIMIT :limit''',
+                params
+            )
+        return cursor.fetchall()
+
+    def claim_raffles(self, after=None, limit=QUEUE_BATCH_SIZE, lease=LEASE_TTL):
+        """Захват следующей порции очереди в аренду на lease секунд.
+
+        Чтение порции и запись аренды выполняются одной транзакцией с
+        блокировкой записи, поэтому разные процессы не получают одни и те же
+        раздачи. Просроченная аренда освобождается. Аргументы и результат -
+        как у get_unprocessed_batch.
+
+        Исключительность гарантируется для процессов одного компьютера.
+        Если файл базы общий для нескольких компьютеров, все они должны
+        открывать его с профилем 'network': блокировки WAL через сеть не работают.
+        """
+        conn = self.connect()
+        now = time.time()
+
+        try:
+            with self.batch():
+                conn.execute(
+                    'DELETE FROM raffle_leases WHERE expires_at <= ?', (now,))
+                raffles = self.get_unprocessed_batch(after, limit)
+                conn.executemany(
+                    '''INSERT OR REPLACE INTO raffle_leases (account, raffle_id, owner, expires_at)
+                    VALUES (?, ?, ?, ?)''',
+                    [(self.account, raffle['id'], self.owner, now + lease)
+                     for raffle in raffles]
+                )
+            return raffles
+        except sqlite3.Error as e:
+            print(f"Ошибка при захвате раздач в аренду: {e}")
+            return []
+
+    def renew_leases(self, lease=LEASE_TTL):
+        """Продление аренды всех раздач этого процесса. Возвращает их количество.
+
+        Заодно обновляется время состояния процесса: по нему другие процессы
+        узнают, что этот ещё работает (см. owner_alive).
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        now = time.time()
+
+        try:
+            cursor.execute(
+                'UPDATE raffle_leases SET expires_at = ? WHERE owner = ?',
+                (now + lease, self.owner)
+            )
+            renewed = cursor.rowcount
+            cursor.execute(
+                'UPDATE run_state SET updated_at = ? WHERE owner = ?', (now, self.owner))
+            self._commit()
+            return renewed
+        except sqlite3.Error as e:
+            print(f"Ошибка при продлении аренды раздач: {e}")
+            return 0
+
+    def release_raffle(self, url):
+        """Освобождение аренды раздачи."""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                '''DELETE FROM raffle_leases
+                WHERE owner = ? AND account = ?
+                    AND raffle_id = (SELECT id FROM raffles WHERE code = ?)''',
+                (self.owner, self.account, raffle_code(url))
+            )
+            self._commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Ошибка при освобождении аренды раздачи: {e}")
+            return False
+
+    def release_leases(self, owner=None):
+        """Освобождение аренды всех раздач этого процесса или владельца owner."""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                'DELETE FROM raffle_leases WHERE owner = ?', (owner or self.owner,))
+            self._commit()
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Ошибка при освобождении аренды раздач: {e}")
+            return 0
+
+    def iter_unprocessed_raffles(self, batch_size=QUEUE_BATCH_SIZE):
+        """Обход очереди необработанных раздач порциями по batch_size.
+
+        Каждая порция читается из базы при обращении к ней, поэтому
+        добавленные и удалённые во время обхода раздачи учитываются.
+        """
+        after = None
+        while True:
+            batch = self.get_unprocessed_batch(after, batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1]['queue_key'], batch[-1]['id'])
+
+    def get_run_state(self, owner=None):
+        """Сохранённое состояние цикла работы этого процесса или владельца owner."""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            'SELECT key, value FROM run_state WHERE owner = ?', (owner or self.owner,))
+        return {key: json.loads(value) for key, value in cursor.fetchall()}
+
+    def set_run_state(self, **values):
+        """Сохранение значений состояния цикла работы этого процесса."""
+        conn = self.connect()
+        now = time.time()
+
+        try:
+            with self._transaction():
+                conn.executemany(
+                    '''INSERT OR REPLACE INTO run_state (owner, account, key, value, updated_at)
+                    VALUES (?, ?, ?, ?, ?)''',
+                    [(self.owner, self.account, key, json.dumps(value), now)
+                     for key, value in values.items()]
+                )
+            return True
+        except (sqlite3.Error, TypeError) as e:
+            print(f"Ошибка при сохранении состояния работы: {e}")
+            return False
+
+    def adopt_run_state(self):
+        """Продолжение работы завершившихся прошлых запусков аккаунта.
+
+        Учитываются только точно завершившиеся процессы (см. owner_alive):
+        их аренда раздач освобождается, а состояние самого позднего из них
+        переходит к этому процессу. Аренда работающих процессов не трогается
+        и истекает сама. Возвращает кортеж (состояние, освобождено раздач).
+        """
+        conn = self.connect()
+        now = time.time()
+
+        try:
+            with self.batch():
+                owners = conn.execute(
+                    '''SELECT owner, MAX(updated_at) AS last_seen FROM run_state
+                    WHERE account = ? AND owner != ?
+                    GROUP BY owner ORDER BY last_seen DESC''',
+                    (self.account, self.owner)
+                ).fetchall()
+                finished = [owner for owner, last_seen in owners
+                            if not owner_alive(owner, last_seen, now)]
+                if not finished:
+                    return {}, 0
+
+                state = self.get_run_state(finished[0])
+                released = 0
+                for owner in finished:
+                    released += conn.execute(
+                        'DELETE FROM raffle_leases WHERE owner = ?', (owner,)).rowcount
+                    conn.execute('DELETE FROM run_state WHERE owner = ?', (owner,))
+                self.set_run_state(**state)
+            return state, released
+        except sqlite3.Error as e:
+            print(f"Ошибка при восстановлении состояния работы: {e}")
+            return {}, 0
+
+    def get_next_attempt_at(self):
+        """Ближайшее время повторной попытки для отложенных раздач или None."""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        if self.account == DEFAULT_ACCOUNT:
+            cursor.execute(
+                'SELECT MIN(next_attempt_at) FROM raffles WHERE processed = 0 AND next_attempt_at > ?',
+                (time.time(),)
+            )
+        else:
+            cursor.execute(
+                '''SELECT MIN(next_attempt_at) FROM raffle_entries
+                WHERE account = ? AND processed = 0 AND next_attempt_at > ?''',
+                (self.account, time.time())
+            )
+        return cursor.fetchone()[0]
+
     def get_stats(self):
         """Получение статистики по раздачам."""
         conn = self.connect()
         cursor = conn.cursor()
 
-        stats = {}
+        # Количество раздач всего, необработанных, обработанных
+        # и закончившихся до того, как до них дошла очередь
+        cursor.execute('SELECT name, value FROM raffle_counters')
+        stats = {name: value for name, value in cursor.fetchall()}
 
-        # Общее количество раздач
-        cursor.execute('SELECT COUNT(*) FROM raffles')
-        stats['total'] = cursor.fetchone()[0]
-
-        # Количество необработанных раздач
-        cursor.execute('SELECT COUNT(*) FROM raffles WHERE processed = 0')
-        stats['unprocessed'] = cursor.fetchone()[0]
+        if self.account != DEFAULT_ACCOUNT:
+            cursor.execute(
+                'SELECT COUNT(*) FROM raffle_entries WHERE account = ? AND processed = 1',
+                (self.account,)
+            )
+            stats['processed'] = cursor.fetchone()[0]
+            # Необработанными считаются только раздачи, которые может взять очередь
+            now = time.time()
+            cursor.execute(
+                f'''SELECT COUNT(*) FROM raffles
+                LEFT JOIN raffle_entries
+                    ON raffle_entries.account = :account AND raffle_entries.raffle_id = raffles.id
+                WHERE COALESCE(raffle_entries.processed, 0) = 0
+                    AND {LIVE_RAFFLE_FILTER} AND {QUEUE_ORDER} >= :now''',
+                {'account': self.account, 'now': now, 'recent': now - LIVE_RAFFLE_WINDOW}
+            )
+            stats['unprocessed'] = cursor.fetchone()[0]
 
-        # Количество обработанных раздач
-        cursor.execute('SELECT COUNT(*) FROM raffles WHERE processed = 1')
-        stats['processed'] = cursor.fetchone()[0]
+        stats['settings'] = self.get_settings()
 
         return stats
+
+    def check_counters(self):
+        """Сверка счётчиков статистики с фактическим содержимым таблицы.
+
+        Возвращает словарь расхождений: имя -> (счётчик, фактическое значение).
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT name, value FROM raffle_counters')
+        counters = dict(cursor.fetchall())
+
+        mismatches = {}
+        for name, query in COUNTER_QUERIES.items():
+            cursor.execute(query)
+            actual = cursor.fetchone()[0]
+            if counters.get(name) != actual:
+                mismatches[name] = (counters.get(name), actual)
+        return mismatches
+
+    @staticmethod
+    def _count_event(conn, name):
+        """Увеличение накопительного счётчика события, если он ведётся."""
+        if name in EVENT_COUNTERS:
+            conn.execute(
+                'UPDATE raffle_counters SET value = value + 1 WHERE name = ?', (name,))
+
+    def rebuild_counters(self):
+        """Полный пересчёт счётчиков статистики.
+
+        Накопительные счётчики событий (EVENT_COUNTERS) сохраняются.
+        """
+        with self._transaction() as conn:
+            placeholders = ', '.join('?' * len(COUNTER_QUERIES))
+            conn.execute(
+                f'DELETE FROM raffle_counters WHERE name IN ({placeholders})',
+                tuple(COUNTER_QUERIES)
+            )
+            for name, query in COUNTER_QUERIES.items():
+                conn.execute(
+                    f'INSERT INTO raffle_counters (name, value) SELECT ?, ({query})',
+                    (name,)
+                )
+
+
+# Проверка и пересчёт счётчиков статистики: python db_manager.py [check|rebuild]
+if __name__ == "__main__":
+    # Тот же профиль, что и у основного скрипта: режим журнала хранится в файле базы
+    from main import DB_PROFILE
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    db = RaffleDatabase(profile=DB_PROFILE)
+
+    if command == "rebuild":
+        db.rebuild_counters()
+        print("Счётчики статистики пересчитаны")
+    else:
+        mismatches = db.check_counters()
+        if mismatches:
+            for name, (counter, actual) in mismatches.items():
+                print(f"Расхождение '{name}': счётчик {counter}, фактически {actual}")
+            print("Для исправления запустите: python db_manager.py rebuild")
+        else:
+            print("Счётчики статистики совпадают с содержимым базы")
+
+    db.close()
@@ -119,16 +119,25 @@ class RaffleStatsWorker(QThread):
         self.running = True
 
     def run(self):
+        # Одно соединение на всё время работы: в режиме WAL чтение не мешает записи
+        db = None
         while self.running:
             try:
-                db = RaffleDatabase()
+                if db is None:
+                    # Тот же профиль, что и у основного скрипта: режим журнала хранится в файле базы
+                    db = RaffleDatabase(profile=main.DB_PROFILE)
                 stats = db.get_stats()
-                db.close()
                 self.stats_updated.emit(stats)
             except Exception as e:
                 print(f"Ошибка при сборе статистики раздач: {str(e)}")
+                if db is not None:
+                    db.close()
+                    db = None
             time.sleep(5)  # Обновление каждые 5 секунд
 
+        if db is not None:
+            db.close()
+
     def stop(self):
         self.running = False
         self.terminate()
@@ -1,12 +1,42 @@
 import os
 import asyncio
+import json
+import time
 import nodriver as uc
 import sys
 
+# Сколько секунд ждать, пока пользователь войдёт в аккаунт
+LOGIN_TIMEOUT = 5 * 60
+# Как часто проверять, выполнен ли вход (в секундах)
+LOGIN_POLL_INTERVAL = 2
+# Ссылки на выход и вход, по которым видно состояние сессии на scrap.tf
+LOGGED_IN_SELECTOR = 'a[href*="/logout"]'
+LOGGED_OUT_SELECTOR = 'a[href*="/login"]'
 
-async def check_and_login():
+# Возвращает 'in', 'out' или 'unknown', если страница ещё не показала ни то, ни другое
+DETECT_LOGIN_JS = '''
+    (() => {
+        if (!location.hostname.endsWith('scrap.tf')) {
+            return 'unknown';
+        }
+        if (document.querySelector(%(logged_in)s)) {
+            return 'in';
+        }
+        if (document.querySelector(%(logged_out)s)) {
+            return 'out';
+        }
+        return 'unknown';
+    })()
+''' % {
+    'logged_in': json.dumps(LOGGED_IN_SELECTOR),
+    'logged_out': json.dumps(LOGGED_OUT_SELECTOR),
+}
+
+
+async def check_and_login(profile_name="browser_profile"):
     """
     Проверяет наличие профиля браузера и при необходимости запускает процесс авторизации.
+    profile_name - имя папки профиля рядом с программой.
     Возвращает True, если профиль уже существует или авторизация прошла успешно.
     """
     # Получаем путь к директории с исполняемым файлом
@@ -17,9 +47,10 @@ async def check_and_login():
         # Если приложение запущено как скрипт
         application_path = os.path.dirname(os.path.abspath(__file__))
 
-    browser_profile_dir = os.path.join(application_path, "browser_profile")
+    browser_profile_dir = os.path.join(application_path, profile_name)
 
-    # Если профиль уже существует, просто возвращаем True
+    # Если профиль уже существует, сессия проверяется на первой открытой странице
+    # (см. ensure_logged_in), поэтому отдельный запуск браузера не нужен
     if os.path.exists(browser_profile_dir):
         print("\n=== Папка профиля браузера уже существует ===")
         print(f"Путь к профилю: {browser_profile_dir}")
@@ -39,13 +70,154 @@ async def check_and_login():
     return login_successful, browser_profile_dir
 
 
+async def get_login_state(tab):
+    """
+    Определяет состояние сессии на открытой странице scrap.tf.
+    Возвращает True (вход выполнен), False (вход не выполнен) или None (неизвестно).
+    """
+    try:
+        state = await tab.evaluate(DETECT_LOGIN_JS, return_by_value=True)
+    except Exception:
+        # Страница сменилась во время проверки
+        return None
+    return {'in': True, 'out': False}.get(state)
+
+
+async def wait_for_login(tab, timeout=LOGIN_TIMEOUT):
+    """
+    Ждёт, пока пользователь войдёт в аккаунт в этой вкладке.
+    Возвращает True сразу после входа или False, если время вышло.
+    """
+    deadline = time.monotonic() + timeout
+    reported = None
+
+    while time.monotonic() < deadline:
+        if await get_login_state(tab):
+            return True
+
+        minutes_left = int((deadline - time.monotonic()) // 60) + 1
+        if minutes_left != reported:
+            print(f"Осталось времени: {minutes_left} минут...")
+            reported = minutes_left
+        await asyncio.sleep(LOGIN_POLL_INTERVAL)
+
+    return False
+
+
+async def ensure_logged_in(tab, timeout=LOGIN_TIMEOUT):
+    """
+    Проверяет сессию на открытой странице scrap.tf и, если вход не выполнен,
+    ждёт повторной авторизации пользователя в этой же вкладке.
+    Возвращает True, если сессия действительна.
+    """
+    # Пока страница не показала ни ссылку входа, ни ссылку выхода, ждём её загрузки
+    deadline = time.monotonic() + 30
+    state = await get_login_state(tab)
+    while state is None and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        state = await get_login_state(tab)
+
+    if state:
+        print("Сессия scrap.tf действительна")
+        return True
+
+    print("\n=== ТРЕБУЕТСЯ ПОВТОРНАЯ АВТОРИЗАЦИЯ ===")
+    print("Сессия scrap.tf недействительна. Войдите в аккаунт Steam в открытом окне браузера.")
+    print(f"У вас есть {timeout // 60} минут для авторизации.")
+
+    if await wait_for_login(tab, timeout):
+        print("=== Авторизация выполнена ===")
+        return True
+
+    print("=== Время на авторизацию истекло ===")
+    return False
+
+
+class SessionExpiredError(Exception):
+    """Сессия scrap.tf истекла во время работы"""
+
+
+class SessionMonitor:
+    """Общее для всех вкладок состояние сессии scrap.tf.
+
+    Первая страница, на которой виден выход из аккаунта, ставит обработку
+    на паузу. Одна из вкладок запрашивает повторную авторизацию, остальные
+    ждут её результата. generation увеличивается после каждого повторного
+    входа: страницы, загруженные раньше, нужно открыть заново.
+    """
+
+    def __init__(self, timeout=LOGIN_TIMEOUT):
+        """Инициализация: сессия считается действительной."""
+        self.timeout = timeout
+        self.generation = 0
+        self.expirations = 0
+        self.failed = False
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def expired(self):
+        """Сессия истекла и ещё не восстановлена."""
+        return not self._ready.is_set() or self.failed
+
+    def report_expired(self):
+        """Отмечает, что сессия истекла."""
+        if self._ready.is_set() and not self.failed:
+            self._ready.clear()
+            self.expirations += 1
+            print("\n=== Сессия scrap.tf истекла: обработка раздач приостановлена ===")
+
+    async def check(self, tab):
+        """Проверяет сессию на открытой странице. Возвращает False, если она истекла."""
+        if await get_login_state(tab) is False:
+            self.report_expired()
+            return False
+        return True
+
+    async def verify(self, tab):
+        """Проверяет сессию на открытой странице и вызывает SessionExpiredError, если она истекла."""
+        if not await self.check(tab):
+            raise SessionExpiredError("session expired")
+
+    async def wait_valid(self):
+        """Ждёт восстановления сессии. Возвращает False, если войти не удалось."""
+        await self._ready.wait()
+        return not self.failed
+
+    async def reauthenticate(self, tab):
+        """Повторная авторизация в этой вкладке, если сессия истекла.
+
+        Возвращает True, если сессия снова действительна.
+        """
+        async with self._lock:
+            if not self.expired:
+                return True
+            if self.failed:
+                return False
+
+            try:
+                await tab.get("https://scrap.tf/")
+                logged_in = await ensure_logged_in(tab, self.timeout)
+            except Exception as e:
+                print(f"Ошибка при повторной авторизации: {str(e)}")
+                logged_in = False
+
+            if logged_in:
+                self.generation += 1
+            else:
+                self.failed = True
+            self._ready.set()
+            return logged_in
+
+
 async def perform_login(profile_dir):
     """
-    Запускает браузер и дает пользователю 5 минут для авторизации.
+    Запускает браузер и ждёт, пока пользователь авторизуется, но не дольше LOGIN_TIMEOUT.
     """
     print("\n=== ТРЕБУЕТСЯ АВТОРИЗАЦИЯ ===")
     print("Сейчас откроется браузер. Вам необходимо войти в аккаунт Steam на сайте scrap.tf")
-    print("У вас есть 5 минут для авторизации.")
+    print(f"У вас есть {LOGIN_TIMEOUT // 60} минут для авторизации.")
 
     try:
         # Запускаем браузер с указанием нашего профиля
@@ -57,19 +229,19 @@ async def perform_login(profile_dir):
         # Открываем сайт для авторизации
         tab = await browser.get("https://scrap.tf/")
 
-        # Даем пользователю 5 минут на авторизацию
-        print("\nОжидание авторизации: 5 минут")
-        for i in range(5, 0, -1):
-            print(f"Осталось времени: {i} минут...")
-            await asyncio.sleep(60)
+        # Ждём, пока на странице появится признак выполненного входа
+        print("\nОжидание авторизации...")
+        login_successful = await wait_for_login(tab)
 
-        print("\n=== Время на авторизацию истекло ===")
-        print("Надеемся, вы успели войти в аккаунт.")
+        if login_successful:
+            print("\n=== Вход в аккаунт выполнен ===")
+        else:
+            print("\n=== Время на авторизацию истекло ===")
         print("Браузер будет закрыт. Профиль сохранен.")
 
         # Закрываем браузер
         browser.stop()
-        return True
+        return login_successful
 
     except Exception as e:
         print(f"Ошибка при авторизации: {str(e)}")
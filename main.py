@@ -1,59 +1,379 @@
 import random
+import time
 import nodriver as uc
 import traceback
 import asyncio
+import json
 import login
-
-from db_manager import RaffleDatabase
+from collections import Counter, deque
+
+from async_db import AsyncRaffleDatabase
+from db_manager import DEFAULT_ACCOUNT, DEFAULT_PROFILE, normalize_raffle_url
+from network_filter import create_blocker
+from pacing import Pacer
+from rate_limiter import HARD_SIGNALS
+from scheduler import RaffleScheduler, ScanIntervalScheduler
+
+# Количество вкладок браузера, одновременно обрабатывающих раздачи
+TABS_COUNT = 3
+# Максимальное время обработки одной раздачи во вкладке (в секундах)
+RAFFLE_TIMEOUT = 90
+# Сколько следующих раздач каждая вкладка загружает заранее в фоновых вкладках
+PREFETCH_DEPTH = 1
+# Профиль настроек SQLite (см. db_manager.PERFORMANCE_PROFILES).
+# Если с одним файлом базы работают несколько компьютеров, нужен 'network'
+DB_PROFILE = DEFAULT_PROFILE
+# Как часто продлевать аренду взятых в обработку раздач (в секундах)
+LEASE_RENEW_INTERVAL = 60
+# Сколько секунд не добавлять повторно исключённую из очереди раздачу, по причинам
+TOMBSTONE_TTL = {
+    "ended": 7 * 24 * 3600,
+    "requirements_not_met": 6 * 3600,
+    "max_attempts": 24 * 3600,
+    "expired": 7 * 24 * 3600,
+    "full": 7 * 24 * 3600,
+}
+# Повторные попытки вступления: начальная и максимальная задержка (в секундах)
+RETRY_BASE_DELAY = 5 * 60
+RETRY_MAX_DELAY = 6 * 3600
+# После стольких неудачных попыток раздача исключается из очереди
+MAX_ATTEMPTS = 5
+# Прокрутка списка раздач останавливается после стольких уже известных раздач подряд
+KNOWN_STREAK_LIMIT = 30
+# Максимальное количество прокруток одной страницы списка
+MAX_SCROLLS = 50
+# Сколько секунд ждать подгрузки новых раздач после прокрутки
+SCROLL_LOAD_TIMEOUT = 10
+# Страницы списков раздач, сканируемые параллельно в отдельных вкладках
+LISTING_SOURCES = [
+    ("все раздачи", "https://scrap.tf/raffles"),
+    ("скоро закончатся", "https://scrap.tf/raffles/ending"),
+]
+
+# Способ вступления: "direct" - запрос страницы EnterRaffle с чтением ответа сервера,
+# "click" - нажатие кнопки и ожидание появления кнопки Leave
+ENTRY_MODE = "direct"
+# Сколько секунд ждать ответа сервера на запрос EnterRaffle
+DIRECT_ENTRY_TIMEOUT = 15
+
+ENTER_BUTTON_SELECTOR = 'button.btn-info.btn-lg[onclick*="EnterRaffle"]:not([id="raffle-enter"])'
+LEAVE_BUTTON_SELECTOR = 'button.btn-danger.btn-lg[onclick*="LeaveRaffle"]'
+
+# Вызывает EnterRaffle самой страницы (с её CSRF и hash параметрами)
+# и перехватывает ответ сервера на этот запрос
+ENTER_RAFFLE_DIRECT_JS = '''
+    new Promise(resolve => {
+        const button = document.querySelector(%(selector)s);
+        if (!button) {
+            resolve(JSON.stringify({status: 'no_button'}));
+            return;
+        }
+
+        const open = XMLHttpRequest.prototype.open;
+        const send = XMLHttpRequest.prototype.send;
+        const restore = () => {
+            XMLHttpRequest.prototype.open = open;
+            XMLHttpRequest.prototype.send = send;
+        };
+        const timer = setTimeout(() => {
+            restore();
+            resolve(JSON.stringify({status: 'timeout'}));
+        }, %(timeout_ms)d);
+
+        XMLHttpRequest.prototype.open = function (method, url) {
+            this._raffleRequestUrl = String(url);
+            return open.apply(this, arguments);
+        };
+        XMLHttpRequest.prototype.send = function () {
+            if (this._raffleRequestUrl && this._raffleRequestUrl.includes('EnterRaffle')) {
+                this.addEventListener('loadend', () => {
+                    clearTimeout(timer);
+                    restore();
+                    let data = null;
+                    try {
+                        data = JSON.parse(this.responseText);
+                    } catch (e) {}
+                    resolve(JSON.stringify({
+                        status: 'response',
+                        http_status: this.status,
+                        data: data,
+                        text: data ? null : String(this.responseText).slice(0, 300)
+                    }));
+                });
+            }
+            return send.apply(this, arguments);
+        };
+
+        button.click();
+    })
+'''
+
+# Фразы сайта о том, что аккаунт не подходит под условия раздачи.
+# Ищутся только в сообщениях сайта, а не в описании раздачи от её автора
+REQUIREMENTS_PHRASES = (
+    "requirements", "not eligible", "you must be", "you need to be",
+)
+NOTICE_SELECTOR = '.alert'
+
+# Определяет, почему на странице раздачи нет кнопки Enter.
+# 'unknown' - страница не объясняет причину (ошибка, недогруженная страница, проверка)
+DETECT_NO_ENTER_REASON_JS = '''
+    (() => {
+        if (document.querySelector('button[onclick*="LeaveRaffle"]')) {
+            return 'already_entered';
+        }
+        const text = document.body ? document.body.innerText.toLowerCase() : '';
+        if (text.includes('raffle has ended') || text.includes('raffle ended')) {
+            return 'ended';
+        }
+        const notices = Array.from(document.querySelectorAll(%(notice)s))
+            .map(notice => notice.innerText.toLowerCase());
+        if (notices.some(notice => %(requirements)s.some(phrase => notice.includes(phrase)))) {
+            return 'requirements_not_met';
+        }
+        return 'unknown';
+    })()
+''' % {'requirements': json.dumps(REQUIREMENTS_PHRASES), 'notice': json.dumps(NOTICE_SELECTOR)}
+
+# Собирает со страницы списка данные всех раздач за один проход по DOM
+EXTRACT_RAFFLES_JS = '''
+    JSON.stringify(Array.from(document.querySelectorAll('.panel-raffle')).map(panel => {
+        const link = panel.querySelector('.panel-heading a');
+        const body = panel.querySelector('.panel-body');
+        const timer = panel.querySelector('[data-time]');
+        // Счётчик ищется только в своём элементе: в названии раздачи тоже бывает "N/M"
+        const entriesNode = panel.querySelector('[class*="entries"]');
+        const counts = entriesNode
+            ? entriesNode.innerText.match(/(\\d[\\d,]*)\\s*\\/\\s*(\\d[\\d,]*)/)
+            : null;
+        return {
+            url: link ? link.href : null,
+            title: link ? link.textContent.trim() : null,
+            entered: panel.classList.contains('raffle-entered')
+                || !!panel.querySelector('.raffle-entered'),
+            items: body ? body.querySelectorAll('.item').length : null,
+            ends_at: timer ? timer.getAttribute('data-time') : null,
+            entries: counts ? counts[1] : null,
+            max_entries: counts ? counts[2] : null
+        };
+    }).filter(raffle => raffle.url && raffle.url.includes('/raffles/')))
+'''
+
+# Прокручивает список раздач до конца и возвращает текущее количество панелей
+SCROLL_LISTING_JS = '''
+    (() => {
+        window.scrollTo(0, document.body.scrollHeight);
+        return document.querySelectorAll('.panel-raffle').length;
+    })()
+'''
+
+
+def _parse_number(value):
+    """Преобразует число со страницы в int или None"""
+    try:
+        return int(float(str(value).replace(',', '')))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_raffle_records(raw_records):
+    """Приводит данные раздач со страницы к записям для базы данных"""
+    records = []
+    for raw in raw_records:
+        url = normalize_raffle_url(raw['url'])
+
+        ends_at = _parse_number(raw.get('ends_at'))
+        # Время окончания может быть указано в миллисекундах
+        if ends_at is not None and ends_at > 10 ** 11:
+            ends_at //= 1000
+
+        records.append({
+            'url': url,
+            'ends_at': ends_at,
+            'entries': _parse_number(raw.get('entries')),
+            'max_entries': _parse_number(raw.get('max_entries')),
+            'title': raw.get('title') or None,
+            'items': _parse_number(raw.get('items')),
+            'entered': bool(raw.get('entered')),
+        })
+    return records
+
+
+async def scroll_for_more(tab, pacer):
+    """Прокручивает список и ждёт подгрузки новых раздач.
+
+    Возвращает False, если новые раздачи так и не появились.
+    """
+    panels_before = await tab.evaluate(SCROLL_LISTING_JS, return_by_value=True)
+    if not isinstance(panels_before, int):
+        panels_before = 0
+
+    return await pacer.wait_until(
+        tab,
+        f"document.querySelectorAll('.panel-raffle').length > {panels_before}",
+        "scroll",
+        timeout=SCROLL_LOAD_TIMEOUT
+    )
 
 
-async def collect_raffles_from_page(tab, db):
-    """Собирает раздачи с текущей страницы"""
+async def harvest_listing(tab, db, pacer, known_streak_limit=KNOWN_STREAK_LIMIT,
+                          max_scrolls=MAX_SCROLLS):
+    """Собирает раздачи со страницы списка, прокручивая её.
+
+    Прокрутка останавливается, когда подряд встречается known_streak_limit
+    уже известных раздач, список заканчивается или достигнут max_scrolls.
+    Возвращает список записей и отчёт о сканировании.
+    """
+    started = time.monotonic()
+    records = {}
+    known_count = 0
+    known_streak = 0
+    scrolls = 0
+
+    while True:
+        raw_records = await tab.evaluate(
+            EXTRACT_RAFFLES_JS, return_by_value=True)
+        page_records = [
+            record for record in parse_raffle_records(json.loads(raw_records))
+            if record['url'] not in records
+        ]
+        known = await db.get_known_urls(record['url'] for record in page_records)
+
+        for record in page_records:
+            records[record['url']] = record
+            if record['url'] in known:
+                known_count += 1
+                known_streak += 1
+                if known_streak >= known_streak_limit:
+                    break
+            else:
+                known_streak = 0
+
+        if known_streak >= known_streak_limit:
+            stop_reason = "известные раздачи"
+            break
+        if scrolls >= max_scrolls:
+            stop_reason = "лимит прокруток"
+            break
+        if not await scroll_for_more(tab, pacer):
+            stop_reason = "конец списка"
+            break
+        scrolls += 1
+
+    report = {
+        'seen': len(records),
+        'known': known_count,
+        'scrolls': scrolls,
+        'stop_reason': stop_reason,
+        'elapsed': time.monotonic() - started,
+    }
+    return list(records.values()), report
+
+
+def merge_raffle_records(record_lists):
+    """Объединяет записи раздач из нескольких источников без повторов.
+
+    Для раздачи, найденной в нескольких источниках, непустые значения
+    дополняют друг друга.
+    """
+    merged = {}
+    for records in record_lists:
+        for record in records:
+            existing = merged.get(record['url'])
+            if existing is None:
+                merged[record['url']] = dict(record)
+                continue
+
+            for key, value in record.items():
+                if existing.get(key) is None:
+                    existing[key] = value
+            existing['entered'] = existing['entered'] or record['entered']
+
+    return list(merged.values())
+
+
+async def open_tab(browser):
+    """Открывает пустую вкладку и подключает к ней блокировку ресурсов.
+
+    Возвращает кортеж (вкладка, блокировщик или None).
+    """
+    tab = await browser.get("about:blank", new_tab=True)
+    blocker = await create_blocker(tab)
+    return tab, blocker
+
+
+async def close_tab(tab):
+    """Закрывает вкладку, игнорируя ошибки"""
     try:
-        await tab.wait_for('#raffles-list', timeout=30)
-        await asyncio.sleep(random.uniform(5.0, 10.0))
-
-        raffle_links = await tab.evaluate('''
-            Array.from(document.querySelectorAll('.panel-raffle .panel-heading a'))
-                .map(a => a.href)
-                .filter(href => href && href.includes('/raffles/'));
-        ''')
+        await tab.close()
+    except Exception:
+        pass
 
-        if not raffle_links:
-            print("Не удалось найти ни одной ссылки на раздачу!")
-            return 0, 0
 
-        new_raffles = 0
-        existing_raffles = 0
+async def scan_listing(browser, db, pacer, name, url, session=None):
+    """Сканирует одну страницу списка раздач в отдельной вкладке"""
+    print(f"Сканируем {name}: {url}")
+    tab, blocker = await open_tab(browser)
 
-        for link in raffle_links:
-            if isinstance(link, dict) and 'value' in link:
-                link = link['value']
+    try:
+        await pacer.navigate(tab, url, ['#raffles-list .panel-raffle'], "scan")
+        if session is not None:
+            # Список виден и без входа, но выход из аккаунта заметен уже здесь
+            await session.check(tab)
+        await pacer.jitter("scan")
+
+        records, report = await harvest_listing(tab, db, pacer)
+        print(
+            f"[{name}] Просмотрено {report['seen']} раздач (известных: {report['known']}), "
+            f"прокруток: {report['scrolls']}, остановка: {report['stop_reason']}, "
+            f"время сканирования: {report['elapsed']:.1f} с")
+        if blocker:
+            print(f"[{name}] Ресурсы: {blocker.page_summary()}")
+        return records
+    finally:
+        await close_tab(tab)
 
-            if not link.startswith('https://scrap.tf'):
-                link = f"https://scrap.tf{link}"
 
-            try:
-                if not db.is_raffle_exists(link):
-                    if db.add_raffle(link):
-                        new_raffles += 1
-                else:
-                    existing_raffles += 1
-            except Exception as e:
-                print(f"Исключение при добавлении в базу данных: {str(e)}")
-                traceback.print_exc()
+async def scan_listings(browser, db, pacer, sources=LISTING_SOURCES, session=None):
+    """Параллельно сканирует все страницы списков и сохраняет раздачи одной записью в базу.
 
-        return new_raffles, existing_raffles
+    Возвращает кортеж (новых, уже существующих).
+    """
+    results = await asyncio.gather(
+        *(scan_listing(browser, db, pacer, name, url, session) for name, url in sources),
+        return_exceptions=True
+    )
 
-    except Exception as e:
-        print(f"Ошибка при сборе раздач: {str(e)}")
-        traceback.print_exc()
+    record_lists = []
+    for (name, _), result in zip(sources, results):
+        if isinstance(result, Exception):
+            print(f"Ошибка при сборе раздач ({name}): {str(result)}")
+            traceback.print_exception(result)
+            continue
+        record_lists.append(result)
+
+    records = merge_raffle_records(record_lists)
+    if not records:
+        print("Не удалось найти ни одной ссылки на раздачу!")
         return 0, 0
 
+    entered = sum(1 for record in records if record['entered'])
+    if entered:
+        print(f"Найдено {entered} раздач, в которых мы уже участвуем")
+
+    return await db.add_raffles(records)
+
 
-async def main():
-    print("=== Проверка авторизации ===")
-    login_result, profile_path = await login.check_and_login()
+async def main(account=DEFAULT_ACCOUNT, profile_name="browser_profile", scan=True,
+               shared=False):
+    """Основной цикл: сканирование списков раздач и участие в них.
+
+    При запуске нескольких аккаунтов (см. accounts.py) списки сканирует
+    только один из них (scan=True), а остальные участвуют в найденных им
+    раздачах, храня своё состояние участия в общей базе.
+    """
+    print(f"=== Проверка авторизации ({account}) ===")
+    login_result, profile_path = await login.check_and_login(profile_name)
 
     if not login_result:
         print("Ошибка авторизации. Работа программы остановлена.")
@@ -61,7 +381,24 @@ async def main():
 
     print("=== Авторизация успешна, запускаем основной скрипт ===")
 
-    db = RaffleDatabase()
+    db = AsyncRaffleDatabase(profile=DB_PROFILE, account=account, shared=shared)
+    pacer = Pacer()
+    session = login.SessionMonitor()
+
+    # Продолжаем с того места, на котором остановился прошлый запуск.
+    # Раздачи завершившегося запуска сразу возвращаются в очередь,
+    # а запуски, которые ещё работают, не затрагиваются
+    state, released = await db.adopt_run_state()
+    scan_scheduler = ScanIntervalScheduler.from_dict(state.get('scan_scheduler'))
+    next_scan_at = state.get('next_scan_at') or 0
+    if state.get('phase'):
+        print(f"Восстановлено состояние прошлого запуска: этап {state['phase']}"
+              + (f", раздача {state['current_raffle']}" if state.get('current_raffle') else ""))
+    if released:
+        print(f"Возвращено в очередь раздач прошлого запуска: {released}")
+    await db.set_run_state(phase="start")
+    # Продление аренды идёт всё время работы: по нему другие процессы видят, что этот жив
+    heartbeat = asyncio.create_task(renew_leases(db))
 
     browser = await uc.start(
         headless=False,
@@ -72,55 +409,100 @@ async def main():
         print("\n=== Запускаем браузер с локальным профилем ===")
         print(f"Путь к профилю: {profile_path}")
 
+        settings = (await db.get_stats())['settings']
+        print(
+            "Настройки базы данных: " + ", ".join(f"{key}={value}" for key, value in settings.items()))
+
         tab = await browser.get("https://scrap.tf/")
-        await asyncio.sleep(5)
+        await pacer.wait_until(
+            tab, "document.readyState === 'complete'", "navigate")
+
+        # Профиль мог остаться от старой сессии: проверяем вход на уже открытой странице
+        if not await login.ensure_logged_in(tab):
+            print("Ошибка авторизации. Работа программы остановлена.")
+            return
 
         while True:
-            stats_before = db.get_stats()
+            stats_before = await db.get_stats()
             print("\n=== Новая итерация сканирования ===")
             print(
                 f"Статистика перед сканированием: Всего раздач: {stats_before['total']}, Необработанных: {stats_before['unprocessed']}, Обработанных: {stats_before['processed']}")
 
-            # Собираем раздачи с /raffles
-            print("\nСканируем все раздачи...")
-            tab = await browser.get("https://scrap.tf/raffles")
-            await asyncio.sleep(random.uniform(5.0, 10.0))
-            all_new, all_existing = await collect_raffles_from_page(tab, db)
-            print(
-                f"С основной страницы: {all_new} новых раздач, {all_existing} существующих")
-
-            # Собираем раздачи с /raffles/ending
-            print("\nСканируем раздачи, которые скоро закончатся...")
-            tab = await browser.get("https://scrap.tf/raffles/ending")
-            await asyncio.sleep(random.uniform(5.0, 10.0))
-            ending_new, ending_existing = await collect_raffles_from_page(tab, db)
-            print(
-                f"С ending: {ending_new} новых раздач, {ending_existing} существующих")
-
-            total_new = ending_new + all_new
-            total_existing = ending_existing + all_existing
-            print(
-                f"\nВсего собрано: {total_new} новых раздач, {total_existing} уже существующих")
-
-            stats_after = db.get_stats()
+            scanned = False
+            if scan and time.time() < next_scan_at:
+                print(
+                    f"\nСписки недавно сканировались, следующее сканирование "
+                    f"через {(next_scan_at - time.time()) / 60:.1f} минут")
+            elif scan:
+                await db.set_run_state(phase="scan")
+                scan_started = time.monotonic()
+
+                print("\nСканируем списки раздач...")
+                total_new, total_existing = await scan_listings(
+                    browser, db, pacer, session=session)
+                print(
+                    f"\nВсего собрано: {total_new} новых раздач, {total_existing} уже существующих")
+                print(
+                    f"Сканирование заняло {time.monotonic() - scan_started:.1f} с")
+                scan_scheduler.record_scan(total_new)
+                scanned = True
+                # Предварительное время следующего сканирования: если работа прервётся
+                # во время обработки, следующий запуск не будет сканировать сразу.
+                # Окончательное время выбирается после обработки
+                next_scan_at = time.time() + scan_scheduler.next_interval()[0]
+                await db.set_run_state(
+                    scan_scheduler=scan_scheduler.to_dict(), next_scan_at=next_scan_at)
+            else:
+                print("\nСписки раздач сканирует основной аккаунт, сканирование пропущено")
+
+            stats_after = await db.get_stats()
+
+            if session.expired and not await session.reauthenticate(tab):
+                print("Сессия scrap.tf не восстановлена. Работа программы остановлена.")
+                return
 
             print("\n--- Начинаем обработку необработанных раздач ---")
-            await process_unprocessed_raffles(browser, db)
+            await db.set_run_state(phase="enter")
+            await process_unprocessed_raffles(
+                browser, db, pacer=pacer, session=session)
+            await db.set_run_state(current_raffle=None)
 
-            stats_final = db.get_stats()
+            if session.failed:
+                print("Сессия scrap.tf не восстановлена. Работа программы остановлена.")
+                return
+
+            stats_final = await db.get_stats()
             print("\nИтоговая статистика:")
             print(f"Всего раздач в базе: {stats_final['total']}")
             print(f"Необработанных раздач: {stats_final['unprocessed']}")
             print(f"Обработанных раздач: {stats_final['processed']}")
+            print(
+                f"Закончились в очереди до обработки: {stats_final['expired']}")
             print(
                 f"Обработано за этот запуск: {stats_final['processed'] - stats_after['processed']}")
-
-            wait_minutes = random.uniform(5, 20)
-            wait_seconds = int(wait_minutes * 60)
-            print(f"Следующая проверка через {wait_minutes:.1f} минут")
+            print("\nВремя ожиданий и пауз с начала работы:")
+            print(pacer.summary())
+
+            wait_seconds, arrival_rate = scan_scheduler.next_interval(
+                await db.get_next_attempt_at(), backlog=stats_final['unprocessed'])
+            # Небольшой разброс, чтобы сканирования не шли строго по расписанию
+            wait_seconds *= random.uniform(0.9, 1.1)
+            if scanned or next_scan_at <= time.time():
+                next_scan_at = time.time() + wait_seconds
+            else:
+                # Сканирование пропущено: остаётся время, выбранное прошлым запуском
+                next_scan_at = min(next_scan_at, time.time() + wait_seconds)
+                wait_seconds = next_scan_at - time.time()
+            await db.set_run_state(phase="wait", next_scan_at=next_scan_at)
+            if arrival_rate is None:
+                print("Частота появления раздач ещё не оценена")
+            else:
+                print(
+                    f"Оценка частоты появления раздач: {arrival_rate * 3600:.1f} в час")
+            print(f"Следующая проверка через {wait_seconds / 60:.1f} минут")
 
             print(
-                f"Ожидаем {wait_minutes:.1f} минут перед следующим сканированием...")
+                f"Ожидаем {wait_seconds / 60:.1f} минут перед следующим сканированием...")
             await asyncio.sleep(wait_seconds)
 
     except Exception as e:
@@ -136,60 +518,299 @@ async def main():
             print(f"Ошибка при закрытии браузера: {str(browser_error)}")
             pass
 
-        db.close()
+        heartbeat.cancel()
+        await db.close()
         print("База данных закрыта")
 
 
-async def process_unprocessed_raffles(browser, db):
-    unprocessed_raffles = db.get_unprocessed_raffles()
+class RaffleEntryError(Exception):
+    """Неудачная попытка вступления в раздачу"""
+
+
+async def handle_entry_failure(db, url, error, prefix=""):
+    """Откладывает повторную попытку или исключает раздачу после MAX_ATTEMPTS"""
+    attempts = await db.record_failure(url, error, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
 
-    if not unprocessed_raffles:
+    if attempts >= MAX_ATTEMPTS:
+        print(f"{prefix}Исчерпаны попытки вступления ({attempts}). Исключаем раздачу из очереди.")
+        await db.tombstone_raffle(url, "max_attempts", TOMBSTONE_TTL["max_attempts"])
+    else:
+        print(f"{prefix}Попытка {attempts} из {MAX_ATTEMPTS} не удалась ({error}), повторим позже.")
+
+
+async def enter_raffle_direct(tab, pacer, prefix=""):
+    """Вступает в раздачу запросом EnterRaffle из контекста страницы.
+
+    Возвращает True, если сервер подтвердил вступление, и False, если
+    ответ перехватить не удалось. При отказе сервера выбрасывает
+    RaffleEntryError с его причиной.
+    """
+    print(f"{prefix}Отправляем запрос EnterRaffle...")
+    raw_result = await tab.evaluate(
+        ENTER_RAFFLE_DIRECT_JS % {
+            'selector': json.dumps(ENTER_BUTTON_SELECTOR),
+            'timeout_ms': DIRECT_ENTRY_TIMEOUT * 1000,
+        },
+        await_promise=True,
+        return_by_value=True
+    )
+
+    try:
+        result = json.loads(raw_result)
+    except (TypeError, ValueError):
+        print(f"{prefix}Не удалось выполнить запрос EnterRaffle на странице.")
+        return False
+
+    if result['status'] != "response":
+        print(f"{prefix}Ответ на запрос EnterRaffle не получен ({result['status']}).")
+        return False
+
+    data = result['data']
+    message = data.get('message') if isinstance(data, dict) else result['text']
+    pacer.report_response(result['http_status'], message)
+
+    if isinstance(data, dict) and data.get('success'):
+        return True
+
+    if isinstance(data, dict):
+        reason = data.get('message') or "declined"
+    else:
+        reason = f"HTTP {result['http_status']}: {result['text']}"
+    print(f"{prefix}Сервер отклонил вступление: {reason}")
+    raise RaffleEntryError(reason)
+
+
+async def open_raffle(tab, url, pacer, prefix="", session=None):
+    """Получает разрешение ограничителя частоты и открывает раздачу во вкладке.
+
+    Переход и вступление считаются одним действием для ограничителя;
+    ожидание разрешения не входит в RAFFLE_TIMEOUT.
+    Если страница не загрузилась как страница раздачи или сайт подал явный
+    признак ограничения, вызывает RaffleEntryError: раздача откладывается, а не
+    исключается. Медленный ответ только замедляет ограничитель частоты.
+    Возвращает кортеж (появились ли кнопки, признак ограничения или None).
+    """
+    await pacer.limiter.acquire()
+    print(f"{prefix}Переход по ссылке: {url}")
+    ready, signal = await asyncio.wait_for(
+        pacer.navigate(
+            tab, url, [ENTER_BUTTON_SELECTOR, LEAVE_BUTTON_SELECTOR],
+            "navigate", acquire=False),
+        timeout=RAFFLE_TIMEOUT
+    )
+
+    if signal in HARD_SIGNALS:
+        raise RaffleEntryError(f"page_not_ready ({signal})")
+    if not ready:
+        # Закончившиеся раздачи и раздачи с условиями тоже без кнопок,
+        # но страница это явно сообщает
+        reason = await tab.evaluate(
+            DETECT_NO_ENTER_REASON_JS, return_by_value=True)
+        if reason not in TOMBSTONE_TTL and reason != "already_entered":
+            if session is not None:
+                # Страница без кнопок может означать выход из аккаунта
+                await session.verify(tab)
+            raise RaffleEntryError("page_not_ready")
+    return ready, signal
+
+
+async def enter_raffle(tab, db, url, pacer, prefix="", session=None):
+    """Пытается вступить в раздачу, уже открытую во вкладке.
+
+    Возвращает "entered", "failed" или "removed". Если кнопки нет или
+    вступление не удалось из-за истёкшей сессии, вызывает
+    SessionExpiredError, ничего не меняя в базе.
+    """
+    await pacer.jitter("navigate")
+
+    # Проверяем кнопку Enter
+    enter_button = await tab.query_selector(ENTER_BUTTON_SELECTOR)
+    if enter_button is None:
+        reason = await tab.evaluate(
+            DETECT_NO_ENTER_REASON_JS, return_by_value=True)
+        if reason == "already_entered":
+            print(f"{prefix}Уже участвуем в раздаче. Отмечаем как обработанную.")
+            await db.mark_as_processed(url)
+            return "entered"
+
+        if session is not None:
+            # Без входа в аккаунт кнопки нет ни в одной раздаче
+            await session.verify(tab)
+        if reason not in TOMBSTONE_TTL:
+            # Без явной причины раздача не исключается, а откладывается
+            raise RaffleEntryError("no_enter_button")
+
+        print(f"{prefix}Кнопка Enter не найдена ({reason}). Исключаем раздачу из очереди.")
+        await db.tombstone_raffle(url, reason, TOMBSTONE_TTL[reason])
+        return "removed"
+
+    try:
+        if ENTRY_MODE == "direct":
+            confirmed = await enter_raffle_direct(tab, pacer, prefix)
+        else:
+            print(f"{prefix}Найдена кнопка 'Enter Raffle'. Нажимаем...")
+            await enter_button.click()
+            await pacer.jitter("enter")
+            confirmed = False
+
+        # Проверяем успешность вступления по кнопке Leave
+        if not confirmed and not await pacer.wait_ready(
+                tab, [LEAVE_BUTTON_SELECTOR], "confirm", timeout=30, load_grace=None):
+            raise RaffleEntryError("no_leave_button")
+    except RaffleEntryError:
+        if session is not None:
+            await session.verify(tab)
+        raise
+
+    print(f"{prefix}Успешно вступили в раздачу!")
+    await db.mark_as_processed(url)
+    return "entered"
+
+
+async def raffle_tab_worker(worker_id, browser, scheduler, db, pacer, results,
+                            session, prefetch_depth=PREFETCH_DEPTH):
+    """Обрабатывает раздачи из общей очереди в собственных вкладках браузера.
+
+    Пока в текущей вкладке идёт вступление, следующие prefetch_depth раздач
+    загружаются в фоновых вкладках, после чего вкладки меняются местами.
+    Пока сессия восстанавливается, обработка стоит на паузе.
+    """
+    prefix = f"[Вкладка {worker_id}] "
+
+    # Разносим старт вкладок по времени, чтобы запросы не шли пачкой
+    await asyncio.sleep(random.uniform(0.0, 5.0) * (worker_id - 1))
+    spare = deque()
+    for _ in range(prefetch_depth + 1):
+        spare.append(await open_tab(browser))
+    pending = deque()
+
+    async def start_preloads():
+        """Загружает следующие раздачи во все свободные вкладки"""
+        while spare:
+            raffle = await scheduler.next()
+            if raffle is None:
+                return
+            tab, blocker = spare.popleft()
+            task = asyncio.create_task(
+                open_raffle(tab, raffle['url'], pacer, prefix, session))
+            pending.append((raffle, tab, blocker, task, session.generation))
+
+    try:
+        await start_preloads()
+        while pending:
+            raffle, tab, blocker, load_task, generation = pending.popleft()
+            url = raffle['url']
+
+            try:
+                await load_task
+                if not await session.wait_valid():
+                    # Вход не восстановлен: оставшиеся раздачи не трогаем
+                    spare.append((tab, blocker))
+                    break
+                if generation != session.generation:
+                    # Страница загружена до повторного входа
+                    await open_raffle(tab, url, pacer, prefix, session)
+                await db.set_run_state(current_raffle=url)
+                result = await asyncio.wait_for(
+                    enter_raffle(tab, db, url, pacer, prefix, session),
+                    timeout=RAFFLE_TIMEOUT)
+            except login.SessionExpiredError:
+                print(f"{prefix}Сессия истекла, раздача {url} возвращена в очередь")
+                scheduler.retry(raffle)
+                if session.failed or not await session.reauthenticate(tab):
+                    # Вход не восстановлен: оставшиеся раздачи не трогаем
+                    spare.append((tab, blocker))
+                    break
+                result = "paused"
+            except asyncio.TimeoutError:
+                print(f"{prefix}Превышено время обработки раздачи {url}, пересоздаём вкладку")
+                await handle_entry_failure(db, url, "timeout", prefix)
+                result = "failed"
+                await close_tab(tab)
+                tab, blocker = await open_tab(browser)
+            except RaffleEntryError as e:
+                await handle_entry_failure(db, url, str(e), prefix)
+                result = "failed"
+            except Exception as e:
+                print(f"{prefix}Ошибка при обработке раздачи {url}: {str(e)}")
+                traceback.print_exc()
+                await handle_entry_failure(db, url, type(e).__name__, prefix)
+                result = "failed"
+
+            results[result] += 1
+            if result != "paused":
+                await db.release_raffle(url)
+            if blocker:
+                print(f"{prefix}Ресурсы страницы: {blocker.page_summary()}")
+
+            spare.append((tab, blocker))
+            await start_preloads()
+            await pacer.jitter("between_raffles")
+    finally:
+        for _, tab, _, load_task, _ in pending:
+            load_task.cancel()
+            await close_tab(tab)
+        for tab, _ in spare:
+            await close_tab(tab)
+
+
+async def renew_leases(db):
+    """Продлевает аренду взятых раздач и отмечает, что процесс ещё работает"""
+    while True:
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+        await db.renew_leases()
+
+
+async def process_unprocessed_raffles(browser, db, tabs_count=TABS_COUNT, pacer=None,
+                                      session=None):
+    if pacer is None:
+        pacer = Pacer()
+    if session is None:
+        session = login.SessionMonitor()
+
+    # Раньше обрабатываем раздачи, которые скоро закончатся.
+    # Очередь читается из базы порциями по мере обработки
+    scheduler = RaffleScheduler(source=db.iter_unprocessed_raffles)
+    await scheduler.fill()
+
+    if not len(scheduler):
         print("Нет необработанных раздач для участия.")
         return
 
     print(
-        f"Найдено {len(unprocessed_raffles)} необработанных раздач для участия.")
+        f"Найдено не менее {len(scheduler)} необработанных раздач для участия.")
 
-    processed_count = 0
-    failed_count = 0
+    tabs_count = max(1, min(tabs_count, len(scheduler)))
+    print(f"Обрабатываем раздачи в {tabs_count} вкладках параллельно")
 
-    for raffle in unprocessed_raffles:
-        url = raffle['url']
-        print(f"\nПереход по ссылке: {url}")
+    results = Counter()
+    workers = [
+        raffle_tab_worker(worker_id, browser, scheduler, db, pacer, results, session)
+        for worker_id in range(1, tabs_count + 1)
+    ]
+    skipped = Counter()
+    try:
+        for outcome in await asyncio.gather(*workers, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                print(f"Вкладка завершилась с ошибкой: {str(outcome)}")
 
-        try:
-            tab = await browser.get(url)
-            await asyncio.sleep(random.uniform(5.0, 10.0))
+        for raffle, reason in scheduler.skipped:
+            await db.tombstone_raffle(raffle['url'], reason, TOMBSTONE_TTL[reason])
+            skipped[reason] += 1
+    finally:
+        # Раздачи, оставшиеся в очереди, становятся доступны другим процессам
+        await db.release_leases()
 
-            try:
-                # Проверяем кнопку Enter
-                enter_button = await tab.wait_for('button.btn-info.btn-lg[onclick*="EnterRaffle"]:not([id="raffle-enter"])', timeout=5)
-                print("Найдена кнопка 'Enter Raffle'. Нажимаем...")
-                await enter_button.click()
-                await asyncio.sleep(random.uniform(5.0, 10.0))
-
-                try:
-                    # Проверяем успешность вступления
-                    await tab.wait_for('button.btn-danger.btn-lg[onclick*="LeaveRaffle"]', timeout=30)
-                    print("Успешно вступили в раздачу!")
-                    db.mark_as_processed(url)
-                    processed_count += 1
-                except:
-                    print("Не удалось дождаться появления кнопки 'Leave Raffle'.")
-                    failed_count += 1
-            except:
-                print("Кнопка Enter не найдена. Удаляем раздачу из базы данных.")
-                db.delete_raffle(url)
-
-            await asyncio.sleep(random.uniform(3.0, 5.0))
-
-        except Exception as e:
-            print(f"Ошибка при обработке раздачи {url}: {str(e)}")
-            traceback.print_exc()
-            failed_count += 1
+    if skipped['expired']:
+        print(f"Раздач, закончившихся до начала обработки: {skipped['expired']}")
+    if skipped['full']:
+        print(f"Пропущено заполненных раздач без перехода на страницу: {skipped['full']}")
+
+    if session.expirations:
+        print(f"Сессия истекала во время обработки: {session.expirations} раз")
 
     print(
-        f"\nОбработка раздач завершена: успешно обработано {processed_count}, не удалось обработать {failed_count}")
+        f"\nОбработка раздач завершена: успешно обработано {results['entered']}, не удалось обработать {results['failed']}, удалено {results['removed']}")
 
 if __name__ == "__main__":
     uc.loop().run_until_complete(main())
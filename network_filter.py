@@ -0,0 +1,104 @@
+"""Модуль для блокировки ненужных ресурсов страниц через CDP"""
+from collections import Counter
+
+from nodriver import cdp
+
+# Блокировка включается явно: без неё страницы загружаются полностью
+BLOCK_RESOURCES = False
+# Типы ресурсов, которые не нужны для поиска и нажатия кнопок
+BLOCKED_RESOURCE_TYPES = ["Image", "Media", "Font"]
+# Шаблоны ссылок для блокировки (* - любое количество символов)
+BLOCKED_URL_PATTERNS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*adservice.google.*",
+]
+
+
+class ResourceBlocker:
+    """Блокирует запросы вкладки по типу ресурса и шаблону ссылки.
+
+    Перехватываются только запросы, подходящие под блокировку, поэтому
+    остальные загружаются без задержек. Статистика считается по текущей
+    странице и за всё время работы.
+    """
+
+    def __init__(self, resource_types=None, url_patterns=None):
+        """Инициализация блокировщика."""
+        self.resource_types = list(
+            BLOCKED_RESOURCE_TYPES if resource_types is None else resource_types)
+        self.url_patterns = list(
+            BLOCKED_URL_PATTERNS if url_patterns is None else url_patterns)
+
+        self.page_blocked = Counter()
+        self.page_loaded_bytes = 0
+        self.total_blocked = 0
+        self.total_loaded_bytes = 0
+
+    def _patterns(self):
+        """Шаблоны перехвата для CDP Fetch."""
+        patterns = [
+            cdp.fetch.RequestPattern(
+                url_pattern="*",
+                resource_type=cdp.network.ResourceType(resource_type))
+            for resource_type in self.resource_types
+        ]
+        patterns += [
+            cdp.fetch.RequestPattern(url_pattern=url_pattern)
+            for url_pattern in self.url_patterns
+        ]
+        return patterns
+
+    async def attach(self, tab):
+        """Включает перехват запросов во вкладке."""
+        tab.add_handler(cdp.fetch.RequestPaused, self._on_request_paused)
+        tab.add_handler(cdp.network.LoadingFinished, self._on_loading_finished)
+        await tab.send(cdp.network.enable())
+        await tab.send(cdp.fetch.enable(patterns=self._patterns()))
+
+    async def _on_request_paused(self, event, tab):
+        """Отклоняет перехваченный запрос."""
+        self.page_blocked[event.resource_type.value] += 1
+        self.total_blocked += 1
+
+        try:
+            await tab.send(cdp.fetch.fail_request(
+                event.request_id, cdp.network.ErrorReason.BLOCKED_BY_CLIENT))
+        except Exception:
+            # Вкладка могла быть закрыта или уйти на другую страницу
+            pass
+
+    def _on_loading_finished(self, event):
+        """Учитывает объём загруженных данных."""
+        self.page_loaded_bytes += event.encoded_data_length
+        self.total_loaded_bytes += event.encoded_data_length
+
+    def page_summary(self):
+        """Сводка по текущей странице со сбросом её счётчиков."""
+        blocked = sum(self.page_blocked.values())
+        details = ", ".join(
+            f"{resource_type}: {count}"
+            for resource_type, count in self.page_blocked.most_common())
+        summary = (
+            f"заблокировано запросов: {blocked}"
+            + (f" ({details})" if details else "")
+            + f", загружено {self.page_loaded_bytes / 1024:.0f} КБ")
+
+        self.page_blocked.clear()
+        self.page_loaded_bytes = 0
+        return summary
+
+
+async def create_blocker(tab):
+    """Подключает блокировщик ко вкладке, если блокировка включена.
+
+    Возвращает блокировщик или None.
+    """
+    if not BLOCK_RESOURCES:
+        return None
+
+    blocker = ResourceBlocker()
+    await blocker.attach(tab)
+    return blocker
@@ -0,0 +1,246 @@
+"""Модуль для управления ожиданиями и паузами между действиями в браузере"""
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+from rate_limiter import AdaptiveRateLimiter, SLOW_RESPONSE
+
+# Паузы "как у человека" после действий: (минимум, максимум) в секундах
+JITTER = {
+    "navigate": (1.0, 3.0),
+    "scan": (1.0, 3.0),
+    "enter": (0.5, 1.5),
+    "between_raffles": (1.0, 3.0),
+}
+# Сколько секунд по умолчанию ждать готовности страницы
+READY_TIMEOUT = 30
+# Сколько секунд после загрузки страницы ждать появления нужных элементов
+LOAD_GRACE = 1.5
+
+# Ждёт выполнения условия на странице, отслеживая изменения DOM через MutationObserver.
+# Результат: 'ready' - условие выполнено, 'loaded' - страница загрузилась без него,
+# 'timeout' - время вышло, 'navigating' - во вкладке ещё открыта другая страница
+WAIT_UNTIL_JS = '''
+    new Promise(resolve => {
+        const expected = %(expected_url)s;
+        const current = location.href.split('#')[0].replace(/\\/$/, '');
+        if (expected && current !== expected) {
+            resolve('navigating');
+            return;
+        }
+
+        const check = () => {
+            try {
+                return !!(%(condition)s);
+            } catch (e) {
+                return false;
+            }
+        };
+        let observer = null;
+        let timer = null;
+        let grace = null;
+        const finish = value => {
+            clearTimeout(timer);
+            clearTimeout(grace);
+            if (observer) {
+                observer.disconnect();
+            }
+            resolve(value);
+        };
+
+        if (check()) {
+            finish('ready');
+            return;
+        }
+
+        observer = new MutationObserver(() => {
+            if (check()) {
+                finish('ready');
+            }
+        });
+        observer.observe(document, {childList: true, subtree: true, attributes: true});
+        timer = setTimeout(() => finish('timeout'), %(timeout_ms)d);
+
+        const graceMs = %(grace_ms)d;
+        if (graceMs >= 0) {
+            const onLoaded = () => {
+                grace = setTimeout(() => finish(check() ? 'ready' : 'loaded'), graceMs);
+            };
+            if (document.readyState === 'complete') {
+                onLoaded();
+            } else {
+                window.addEventListener('load', onLoaded);
+            }
+        }
+    })
+'''
+
+# Собирает признаки ограничения со стороны сайта на открытой странице
+DETECT_THROTTLE_JS = '''
+    JSON.stringify((() => {
+        const navigation = performance.getEntriesByType('navigation')[0];
+        const text = document.body ? document.body.innerText.slice(0, 3000).toLowerCase() : '';
+        return {
+            status: navigation && navigation.responseStatus ? navigation.responseStatus : 0,
+            cloudflare: document.title.includes('Just a moment')
+                || !!document.querySelector('#challenge-form, #challenge-running, #cf-challenge-running'),
+            too_fast: /too fast|slow down|too many requests/.test(text)
+        };
+    })())
+'''
+# Фразы сайта о слишком частых действиях
+TOO_FAST_PHRASES = ("too fast", "slow down", "too many requests")
+
+
+def _normalize_url(url):
+    """Приводит ссылку к виду, в котором её возвращает location.href"""
+    return url.split('#')[0].rstrip('/') if url else None
+
+
+class Pacer:
+    """Ожидания по готовности страницы и паузы между действиями со статистикой времени.
+
+    Переходы и вступления проходят через общий для всех вкладок
+    адаптивный ограничитель частоты.
+    """
+
+    def __init__(self, jitter=None, limiter=None):
+        """Инициализация."""
+        self.jitter_ranges = dict(JITTER if jitter is None else jitter)
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.stats = defaultdict(
+            lambda: {'waits': 0, 'work': 0.0, 'pauses': 0, 'idle': 0.0})
+
+    async def wait_until(self, tab, condition, action, timeout=READY_TIMEOUT,
+                         expected_url=None, load_grace=None):
+        """Ждёт выполнения JS-условия на странице.
+
+        Если задан expected_url, условие проверяется только на этой странице.
+        Если задан load_grace, ожидание завершается через load_grace секунд
+        после загрузки страницы, даже когда условие не выполнилось.
+        Возвращает True, если условие выполнено.
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        status = "timeout"
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                status = "timeout"
+                break
+
+            try:
+                status = await tab.evaluate(
+                    WAIT_UNTIL_JS % {
+                        'expected_url': json.dumps(_normalize_url(expected_url)),
+                        'condition': condition,
+                        'timeout_ms': int(remaining * 1000),
+                        'grace_ms': -1 if load_grace is None else int(load_grace * 1000),
+                    },
+                    await_promise=True,
+                    return_by_value=True
+                )
+            except Exception:
+                # Страница сменилась во время ожидания
+                status = None
+
+            if status in ("ready", "loaded", "timeout"):
+                break
+            await asyncio.sleep(0.2)
+
+        self.stats[action]['waits'] += 1
+        self.stats[action]['work'] += time.monotonic() - started
+        return status == "ready"
+
+    async def wait_ready(self, tab, selectors, action, url=None,
+                         timeout=READY_TIMEOUT, load_grace=LOAD_GRACE):
+        """Ждёт загрузки страницы и появления любого из селекторов."""
+        condition = " || ".join(
+            f"document.querySelector({json.dumps(selector)})"
+            for selector in selectors
+        )
+        return await self.wait_until(
+            tab, condition, action, timeout=timeout, expected_url=url,
+            load_grace=load_grace)
+
+    async def navigate(self, tab, url, selectors, action, timeout=READY_TIMEOUT,
+                       acquire=True):
+        """Переход по ссылке с учётом ограничителя частоты.
+
+        Ждёт готовности страницы и передаёт ограничителю признаки ограничения
+        со стороны сайта. Возвращает кортеж (появились ли нужные элементы,
+        признак ограничения или None).
+        С acquire=False разрешение ограничителя должен получить вызывающий код.
+        """
+        if acquire:
+            await self.limiter.acquire()
+
+        started = time.monotonic()
+        await tab.get(url)
+        ready = await self.wait_ready(tab, selectors, action, url, timeout)
+
+        signal = await self.detect_throttle(tab)
+        if signal is None and time.monotonic() - started > SLOW_RESPONSE:
+            signal = "slow"
+
+        if signal:
+            self.limiter.on_signal(signal)
+        else:
+            self.limiter.on_success()
+        return ready, signal
+
+    async def detect_throttle(self, tab):
+        """Признак ограничения на открытой странице или None."""
+        try:
+            info = json.loads(await tab.evaluate(
+                DETECT_THROTTLE_JS, return_by_value=True))
+        except Exception:
+            return None
+
+        if info['status'] in (429, 503):
+            return f"http_{info['status']}"
+        if info['cloudflare']:
+            return "cloudflare"
+        if info['too_fast']:
+            return "too_fast"
+        return None
+
+    def report_response(self, http_status, message=""):
+        """Передаёт ограничителю результат запроса, выполненного без перехода."""
+        message = (message or "").lower()
+
+        if http_status in (429, 503):
+            self.limiter.on_signal(f"http_{http_status}")
+        elif any(phrase in message for phrase in TOO_FAST_PHRASES):
+            self.limiter.on_signal("too_fast")
+        else:
+            self.limiter.on_success()
+
+    async def jitter(self, action):
+        """Случайная пауза после действия в пределах, заданных для него."""
+        low, high = self.jitter_ranges.get(action, (0.0, 0.0))
+        delay = random.uniform(low, high)
+        await asyncio.sleep(delay)
+        self.stats[action]['pauses'] += 1
+        self.stats[action]['idle'] += delay
+
+    def summary(self):
+        """Сводка времени работы и простоя по действиям."""
+        lines = []
+        total_work = 0.0
+        total_idle = 0.0
+
+        for action, stats in sorted(self.stats.items()):
+            total_work += stats['work']
+            total_idle += stats['idle']
+            lines.append(
+                f"{action}: работа {stats['work']:.1f} с ({stats['waits']} ожиданий), "
+                f"паузы {stats['idle']:.1f} с ({stats['pauses']})")
+
+        lines.append(
+            f"Всего: работа {total_work:.1f} с, паузы {total_idle:.1f} с")
+        lines.append(self.limiter.summary())
+        return "\n".join(lines)
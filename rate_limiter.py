@@ -0,0 +1,108 @@
+"""Модуль для адаптивного ограничения частоты запросов к сайту"""
+import asyncio
+import time
+
+# Начальная, минимальная и максимальная частота действий (в действиях в секунду на все вкладки)
+INITIAL_RATE = 0.5
+MIN_RATE = 0.05
+MAX_RATE = 2.0
+# Сколько действий можно выполнить подряд без ожидания
+BURST = 3
+# Прибавка частоты после успешного действия и множитель при признаках ограничения
+RATE_INCREASE = 0.02
+RATE_DECREASE = 0.5
+# Пауза после признака ограничения: начальная и максимальная (в секундах)
+BACKOFF_BASE = 30
+BACKOFF_MAX = 10 * 60
+# Ответ медленнее этого (в секундах) считается признаком перегрузки сайта
+SLOW_RESPONSE = 10.0
+
+# Признаки, после которых нужна пауза, а не только снижение частоты
+HARD_SIGNALS = {"http_429", "http_503", "cloudflare", "too_fast"}
+
+
+class AdaptiveRateLimiter:
+    """Token bucket, частота которого подстраивается по ответам сайта (AIMD).
+
+    Каждое успешное действие немного увеличивает частоту, признак ограничения
+    уменьшает её в несколько раз. Жёсткие признаки (429, 503, проверка
+    Cloudflare, сообщение о слишком частых действиях) дополнительно ставят
+    все действия на паузу, которая растёт при повторении.
+    """
+
+    def __init__(self, rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 burst=BURST):
+        """Инициализация ограничителя."""
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.backoff_until = 0.0
+        self.backoff = 0.0
+        self.last_signal = None
+        self.signals = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        """Пополнение токенов за прошедшее время."""
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ожидание разрешения на следующее действие."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.backoff_until:
+                    await asyncio.sleep(self.backoff_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        """Действие прошло без признаков ограничения."""
+        self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+        self.backoff = 0.0
+
+    def on_signal(self, signal):
+        """Сайт подал признак ограничения или перегрузки."""
+        self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+        self.tokens = 0.0
+        self.last_signal = signal
+        self.signals += 1
+
+        if signal in HARD_SIGNALS:
+            self.backoff = min(
+                BACKOFF_MAX, self.backoff * 2 if self.backoff else BACKOFF_BASE)
+            self.backoff_until = time.monotonic() + self.backoff
+            print(f"[Ограничение] Признак ограничения ({signal}): пауза {self.backoff:.0f} с, "
+                  f"частота снижена до {self.rate:.2f} действий/с")
+
+    def state(self):
+        """Текущее состояние ограничителя."""
+        return {
+            'rate': self.rate,
+            'tokens': self.tokens,
+            'backoff_remaining': max(0.0, self.backoff_until - time.monotonic()),
+            'last_signal': self.last_signal,
+            'signals': self.signals,
+        }
+
+    def summary(self):
+        """Сводка состояния ограничителя."""
+        state = self.state()
+        return (
+            f"Частота действий: {state['rate']:.2f}/с, "
+            f"признаков ограничения: {state['signals']}"
+            + (f" (последний: {state['last_signal']})" if state['last_signal'] else "")
+            + (f", пауза ещё {state['backoff_remaining']:.0f} с"
+               if state['backoff_remaining'] else ""))
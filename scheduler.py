@@ -0,0 +1,218 @@
+"""Модуль для планирования порядка участия в раздачах"""
+import asyncio
+import heapq
+import itertools
+import time
+
+# Сколько секунд до окончания "стоит" один участник раздачи:
+# при равном времени окончания раньше обрабатываются раздачи с меньшим числом участников
+ENTRIES_WEIGHT = 1.0
+# На сколько секунд раньше обрабатывается раздача за каждый разыгрываемый предмет
+ITEMS_WEIGHT = 60.0
+# Раздачи с неизвестным временем окончания считаются заканчивающимися через это время (в секундах)
+UNKNOWN_DEADLINE = 7 * 24 * 3600
+# Сколько раздач держать в очереди при чтении из источника
+PREFETCH_SIZE = 20
+
+
+class RaffleScheduler:
+    """Очередь раздач с приоритетом по ближайшему времени окончания.
+
+    Раздачи можно передать сразу или читать по мере обработки из источника:
+    source() должен возвращать асинхронный итератор, который проходит
+    очередь в базе от начала. Когда проход заканчивается, начинается новый,
+    чтобы подхватить раздачи, добавленные во время обработки. Очередь
+    заканчивается, когда проход не дал ни одной новой раздачи.
+    """
+
+    def __init__(self, raffles=(), entries_weight=ENTRIES_WEIGHT,
+                 items_weight=ITEMS_WEIGHT, source=None, prefetch=PREFETCH_SIZE):
+        """Инициализация очереди."""
+        self.entries_weight = entries_weight
+        self.items_weight = items_weight
+        self.source = source
+        self.prefetch = prefetch
+        self.skipped = []
+        self._heap = []
+        self._order = itertools.count()
+        self._seen = set()
+        self._pass = None
+        self._pass_new = 0
+        self._exhausted = source is None
+        self._lock = asyncio.Lock()
+
+        for raffle in raffles:
+            self.push(raffle)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def priority(self, raffle):
+        """Вычисление приоритета раздачи: чем меньше значение, тем раньше обработка."""
+        ends_at = raffle['ends_at']
+        if ends_at is None:
+            ends_at = time.time() + UNKNOWN_DEADLINE
+
+        return (ends_at
+                + self.entries_weight * (raffle['entries'] or 0)
+                - self.items_weight * (raffle['items'] or 0))
+
+    def push(self, raffle):
+        """Добавление раздачи в очередь.
+
+        Раздача, которая уже была в очереди, повторно не добавляется.
+        """
+        if raffle['id'] in self._seen:
+            return False
+        self._seen.add(raffle['id'])
+        heapq.heappush(
+            self._heap, (self.priority(raffle), next(self._order), raffle))
+        return True
+
+    def retry(self, raffle):
+        """Возврат уже выданной раздачи в очередь для повторной попытки."""
+        heapq.heappush(
+            self._heap, (self.priority(raffle), next(self._order), raffle))
+
+    async def fill(self):
+        """Дочитывание раздач из источника, пока очередь меньше prefetch."""
+        async with self._lock:
+            while len(self._heap) < self.prefetch and not self._exhausted:
+                if self._pass is None:
+                    self._pass = aiter(self.source())
+                    self._pass_new = 0
+
+                try:
+                    raffle = await anext(self._pass)
+                except StopAsyncIteration:
+                    self._pass = None
+                    self._exhausted = not self._pass_new
+                    continue
+
+                if self.push(raffle):
+                    self._pass_new += 1
+
+    async def next(self):
+        """Получение следующей раздачи с дочитыванием из источника или None."""
+        while True:
+            await self.fill()
+            raffle = self.pop()
+            if raffle is not None or self._exhausted:
+                return raffle
+
+    def pop(self):
+        """Получение следующей раздачи или None, если очередь пуста.
+
+        Раздачи, закончившиеся во время ожидания в очереди или набравшие
+        максимум участников, пропускаются и сохраняются в списке skipped
+        вместе с причиной ("expired" или "full").
+        """
+        now = time.time()
+
+        while self._heap:
+            _, _, raffle = heapq.heappop(self._heap)
+            if raffle['ends_at'] is not None and raffle['ends_at'] <= now:
+                self.skipped.append((raffle, "expired"))
+                continue
+            if (raffle['max_entries'] is not None
+                    and (raffle['entries'] or 0) >= raffle['max_entries']):
+                self.skipped.append((raffle, "full"))
+                continue
+            return raffle
+
+        return None
+
+
+# Границы интервала между сканированиями списков (в секундах)
+MIN_SCAN_INTERVAL = 3 * 60
+MAX_SCAN_INTERVAL = 30 * 60
+# Интервал, пока частота появления раздач ещё не оценена
+DEFAULT_SCAN_INTERVAL = 10 * 60
+# Сколько новых раздач в среднем допускается между сканированиями:
+# чем меньше, тем меньше шанс, что короткая раздача закончится до сканирования
+TARGET_NEW_PER_SCAN = 10
+# Вес нового наблюдения в скользящей оценке частоты появления раздач
+RATE_SMOOTHING = 0.3
+# Пока в очереди остаются необработанные раздачи, интервал увеличивается:
+# на каждые столько раздач - на ещё один исходный интервал
+BACKLOG_SCALE = 50
+
+
+class ScanIntervalScheduler:
+    """Выбор времени следующего сканирования по частоте появления новых раздач.
+
+    Частота оценивается отдельно для каждого часа суток скользящим средним
+    по результатам сканирований.
+    """
+
+    def __init__(self):
+        """Инициализация."""
+        self.hourly_rates = {}
+        self.last_scan_at = None
+
+    def record_scan(self, new_raffles, now=None):
+        """Учёт результата сканирования: количества найденных новых раздач."""
+        now = time.time() if now is None else now
+
+        if self.last_scan_at is not None and now > self.last_scan_at:
+            rate = new_raffles / (now - self.last_scan_at)
+            hour = time.localtime(now).tm_hour
+            previous = self.hourly_rates.get(hour)
+            if previous is None:
+                self.hourly_rates[hour] = rate
+            else:
+                self.hourly_rates[hour] = (
+                    RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * previous)
+
+        self.last_scan_at = now
+
+    def to_dict(self):
+        """Состояние планировщика для сохранения между запусками."""
+        return {
+            'hourly_rates': {str(hour): rate for hour, rate in self.hourly_rates.items()},
+            'last_scan_at': self.last_scan_at,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """Восстановление планировщика из сохранённого состояния."""
+        scheduler = cls()
+        if state:
+            scheduler.hourly_rates = {
+                int(hour): rate for hour, rate in state['hourly_rates'].items()}
+            scheduler.last_scan_at = state['last_scan_at']
+        return scheduler
+
+    def estimate_rate(self, now=None):
+        """Оценка частоты появления новых раздач (в раздачах в секунду) или None."""
+        now = time.time() if now is None else now
+        rate = self.hourly_rates.get(time.localtime(now).tm_hour)
+
+        if rate is None and self.hourly_rates:
+            # Для часа без наблюдений используем среднее по остальным
+            rate = sum(self.hourly_rates.values()) / len(self.hourly_rates)
+        return rate
+
+    def next_interval(self, next_retry_at=None, backlog=0, now=None):
+        """Выбор интервала до следующего сканирования (в секундах).
+
+        backlog - количество необработанных раздач в очереди: пока они
+        не разобраны, новые раздачи всё равно ждут, и сканирование откладывается.
+        Если раньше выбранного интервала наступает время повторной попытки
+        для отложенных раздач, сканирование переносится на это время.
+        Возвращает кортеж (интервал, оценка частоты или None).
+        """
+        now = time.time() if now is None else now
+        rate = self.estimate_rate(now)
+
+        if rate:
+            interval = TARGET_NEW_PER_SCAN / rate
+        else:
+            interval = DEFAULT_SCAN_INTERVAL
+        interval *= 1 + backlog / BACKLOG_SCALE
+
+        if next_retry_at is not None:
+            interval = min(interval, next_retry_at - now)
+
+        interval = max(MIN_SCAN_INTERVAL, min(MAX_SCAN_INTERVAL, interval))
+        return interval, rate